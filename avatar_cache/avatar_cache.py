@@ -0,0 +1,76 @@
+""" kk、eat 等插件共用的头像磁盘缓存：按头像 file_unique_id 命名，换头像后自然失效 """
+
+from os import replace, scandir, makedirs, stat, utime, sep
+from os.path import abspath
+from time import time
+from typing import Optional
+from uuid import uuid4
+
+from pyrogram import Client
+
+from pagermaid.utils._path import safe_remove
+from pagermaid.dependence import sqlite
+
+AVATAR_CACHE_DIR = abspath(f"data{sep}avatar_cache")
+# 缓存总大小与有效期，可通过 avatar_cache.maxBytes、avatar_cache.maxAge 调整
+AVATAR_CACHE_BYTES = 64 * 1024 * 1024
+AVATAR_CACHE_AGE = 7 * 24 * 3600
+
+
+def _avatar_limit(key: str, default: int) -> int:
+    try:
+        return int(sqlite.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def evict_avatars() -> None:
+    """删除过期头像，并按修改时间从旧到新删除直到总大小低于上限"""
+    max_age = _avatar_limit("avatar_cache.maxAge", AVATAR_CACHE_AGE)
+    max_bytes = _avatar_limit("avatar_cache.maxBytes", AVATAR_CACHE_BYTES)
+    now = time()
+    entries = []
+    try:
+        for entry in scandir(AVATAR_CACHE_DIR):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            if now - st.st_mtime > max_age:
+                safe_remove(entry.path)
+            elif entry.name.endswith(".jpg"):
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        safe_remove(path)
+        total -= size
+
+
+async def download_avatar(client: Client, chat_photo, small: bool = False) -> Optional[str]:
+    """获取头像的本地缓存路径，未命中时下载；失败返回 None"""
+    if small:
+        unique_id, file_id = chat_photo.small_photo_unique_id, chat_photo.small_file_id
+    else:
+        unique_id, file_id = chat_photo.big_photo_unique_id, chat_photo.big_file_id
+    path = f"{AVATAR_CACHE_DIR}{sep}{unique_id}.jpg"
+    try:
+        if time() - stat(path).st_mtime < _avatar_limit("avatar_cache.maxAge", AVATAR_CACHE_AGE):
+            utime(path)
+            return path
+    except OSError:
+        pass
+    makedirs(AVATAR_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    try:
+        downloaded = await client.download_media(file_id, tmp_path)
+        replace(downloaded, path)
+    except Exception:
+        return None
+    finally:
+        # 超时被取消时也要清理临时文件
+        safe_remove(tmp_path)
+    evict_avatars()
+    return path
@@ -0,0 +1,293 @@
+""" cha 插件订阅解析的离线基准测试
+
+使用合成的订阅内容运行，不需要网络：
+    python cha/benchmark.py parse [--nodes 10000,50000] [--iterations 3]
+    python cha/benchmark.py regions [--names 200000]
+
+parse  分别以 Clash 单行格式、Clash 多行格式与 base64 链接列表生成订阅，
+       比较旧实现（yaml.safe_load 整体加载、整体解码后 splitlines）、
+       完整 YAML 回退解析与流式实现（逐行扫描 proxies 段、分块解码 base64）的耗时与 Python 内存分配峰值
+regions 用标注好的节点名语料检查地区分类结果，并比较旧的逐关键词子串匹配与编译后正则的吞吐量
+"""
+
+import argparse
+import base64
+import importlib.util
+import sys
+import tracemalloc
+import types
+from os.path import abspath, dirname, join
+from random import Random
+from time import perf_counter
+
+import yaml
+
+PLUGIN_DIR = dirname(abspath(__file__))
+NAME_PARTS = [
+    '🇭🇰 香港', 'HK', 'Hong Kong', '🇹🇼 台湾', 'Taiwan', '🇯🇵 日本', 'Japan Tokyo',
+    '🇸🇬 新加坡', 'SG', '🇺🇸 美国', 'US Los Angeles', '🇰🇷 韩国', 'Korea Seoul',
+    '🇩🇪 德国', 'Germany', '🇬🇧 英国', 'UK London', 'Russia', 'Canada', '剩余流量', '官网',
+]
+TYPES = ['ss', 'vmess', 'trojan', 'vless', 'hysteria2']
+
+
+def _stub_framework():
+    """基准测试只调用纯解析函数，用占位模块替代 pagermaid"""
+
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+
+    module("pagermaid")
+    module("pagermaid.enums", Client=object, Message=object)
+    module("pagermaid.listener", listener=lambda **kwargs: (lambda func: func))
+    module("pagermaid.utils", alias_command=lambda command: command)
+    module("pagermaid.utils.bot_utils", log=None)
+    module("pagermaid.dependence", client=None, sqlite={})
+    module("pagermaid.services", bot=None, scheduler=types.SimpleNamespace(add_job=lambda *args, **kwargs: None))
+
+
+def load_plugin():
+    _stub_framework()
+    spec = importlib.util.spec_from_file_location("cha", join(PLUGIN_DIR, "cha.py"))
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules["cha"] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def node_names(count, seed=0):
+    rng = Random(seed)
+    return [f'{rng.choice(NAME_PARTS)} {index:05d} | IEPL x{rng.randint(1, 3)}' for index in range(count)]
+
+
+def clash_flow(count):
+    lines = ['mixed-port: 7890', 'proxies:']
+    for index, name in enumerate(node_names(count)):
+        lines.append(
+            f'  - {{name: "{name}", server: s{index}.example.com, port: {10000 + index}, '
+            f'type: {TYPES[index % len(TYPES)]}, uuid: 00000000-0000-0000-0000-{index:012d}, '
+            f'tls: true, ws-opts: {{path: /ws, headers: {{Host: cdn.example.com}}}}}}'
+        )
+    lines += ['proxy-groups:', '  - {name: Proxy, type: select, proxies: [DIRECT]}', 'rules:', '  - MATCH,Proxy']
+    return '\n'.join(lines) + '\n'
+
+
+def clash_block(count):
+    lines = ['mixed-port: 7890', 'proxies:']
+    for index, name in enumerate(node_names(count)):
+        lines += [
+            f'  - name: "{name}"',
+            f'    type: {TYPES[index % len(TYPES)]}',
+            f'    server: s{index}.example.com',
+            f'    port: {10000 + index}',
+            '    ws-opts:',
+            '      path: /ws',
+            '      headers:',
+            '        Host: cdn.example.com',
+        ]
+    lines += ['proxy-groups:', '  - name: Proxy', '    type: select', '    proxies:', '      - DIRECT']
+    return '\n'.join(lines) + '\n'
+
+
+def uri_list(count):
+    lines = []
+    for index, name in enumerate(node_names(count)):
+        scheme = ['ss', 'vmess', 'trojan', 'vless', 'hy2'][index % 5]
+        lines.append(f'{scheme}://{"x" * 48}@s{index}.example.com:{10000 + index}?sni=cdn.example.com#{name}')
+    return base64.b64encode('\n'.join(lines).encode()).decode()
+
+
+# 旧实现的地区规则，逐个关键词做子串匹配
+LEGACY_REGION_RULES = [
+    ('香港', ['香港', 'hong kong', 'hongkong', 'hk', '🇭🇰']),
+    ('台湾', ['台湾', 'taiwan', 'tw', '🇹🇼']),
+    ('日本', ['日本', 'japan', 'jp', '🇯🇵']),
+    ('新加坡', ['新加坡', 'singapore', 'sg', '🇸🇬']),
+    ('美国', ['美国', 'united states', 'us', 'usa', '🇺🇸']),
+    ('韩国', ['韩国', 'korea', 'kr', '🇰🇷']),
+    ('德国', ['德国', 'germany', 'de', '🇩🇪']),
+    ('英国', ['英国', 'united kingdom', 'uk', '🇬🇧'])
+]
+# (节点名, 期望地区)，None 表示不属于任何地区
+REGION_CORPUS = [
+    ('🇭🇰 香港 01 | IEPL', '香港'),
+    ('HK01 BGP', '香港'),
+    ('Hong Kong 02', '香港'),
+    # HKT 是香港的运营商，作为香港的关键词
+    ('HKT 家宽', '香港'),
+    ('HKBGP01', '香港'),
+    ('JPTokyo 02', '日本'),
+    ('TWHinet', '台湾'),
+    ('SGIPLC-03', '新加坡'),
+    ('USLA 01', '美国'),
+    ('KR-SeoulBGP', '韩国'),
+    ('🇹🇼 台湾 Hinet', '台湾'),
+    ('TW-01', '台湾'),
+    ('🇯🇵 Japan Tokyo 03', '日本'),
+    ('JP 大阪', '日本'),
+    ('狮城 SG 04', '新加坡'),
+    ('🇺🇸 US Los Angeles', '美国'),
+    ('USA Seattle', '美国'),
+    ('Russia Moscow', '俄罗斯'),
+    ('🇷🇺 俄罗斯 01', '俄罗斯'),
+    ('Korea Seoul', '韩国'),
+    ('KR-Chuncheon', '韩国'),
+    ('Germany Frankfurt', '德国'),
+    ('DE 01', '德国'),
+    ('Node de luxe', '德国'),
+    ('Canada Toronto', '加拿大'),
+    ('UK London', '英国'),
+    ('🇬🇧 英国 02', '英国'),
+    ('Netherlands Amsterdam', '荷兰'),
+    ('🇦🇺 Sydney', '澳大利亚'),
+    ('🇳🇿 New Zealand', None),
+    ('Australia 01', '澳大利亚'),
+    ('Turkey Istanbul', '土耳其'),
+    ('🇦🇷 Argentina', '阿根廷'),
+    ('Status: 剩余流量 100GB', None),
+    ('官网 example.com', None),
+    ('Bonus traffic', None),
+    ('Premium Route', None),
+    ('Houston TX', None),
+    ('KRSEOUL', '韩国'),
+    # 全大写的普通单词以地区代码开头，不应归类
+    ('DEDICATED JP', '日本'),
+    ('FREE 01', None),
+    ('TRIAL', None),
+    ('THE BEST', None),
+    ('USER', None),
+    ('MOBILE', None),
+    ('DEMO node', None),
+]
+
+
+def legacy_classify(text):
+    text = text.lower()
+    for region_name, keywords in LEGACY_REGION_RULES:
+        if any(keyword in text for keyword in keywords):
+            return region_name
+    return None
+
+
+FORMATS = {'clash-flow': clash_flow, 'clash-block': clash_block, 'base64': uri_list}
+
+
+def legacy_parse(plugin, text):
+    """旧实现：整体 safe_load，失败后整体解码 base64 再 splitlines"""
+    try:
+        config = yaml.safe_load(text)
+        if isinstance(config, dict) and 'proxies' in config:
+            type_count = {}
+            for proxy in config['proxies']:
+                proxy_type = proxy.get('type', '').lower()
+                type_count[proxy_type] = type_count.get(proxy_type, 0) + 1
+                plugin.classify_region(proxy.get('name', ''))
+            return {'node_count': len(config['proxies']), 'type_count': type_count}
+    except yaml.YAMLError:
+        pass
+    decoded = base64.b64decode(text).decode('utf-8')
+    type_count = {}
+    node_count = 0
+    for line in decoded.splitlines():
+        if not line.strip():
+            continue
+        for pattern in plugin.NODE_PATTERNS:
+            if line.startswith(pattern):
+                type_count[pattern[:-3]] = type_count.get(pattern[:-3], 0) + 1
+                node_count += 1
+                break
+        plugin.classify_region(line)
+    return {'node_count': node_count, 'type_count': type_count}
+
+
+def measure(func, text, iterations):
+    """返回 (最快耗时 ms, Python 分配峰值 MB, 结果)"""
+    best = float('inf')
+    for _ in range(iterations):
+        start = perf_counter()
+        result = func(text)
+        best = min(best, perf_counter() - start)
+    tracemalloc.start()
+    func(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / (1024 * 1024), result
+
+
+def run_parse(plugin, args):
+    loader = 'CSafeLoader' if hasattr(yaml, 'CSafeLoader') else 'SafeLoader（无 libyaml）'
+    print(f"YAML 回退解析器：{loader}")
+    print(
+        f"{'格式':<12}{'节点':>8}{'大小 MB':>9}{'旧 ms':>10}{'回退 ms':>10}{'新 ms':>10}{'加速':>8}"
+        f"{'旧峰值 MB':>11}{'回退峰值 MB':>12}{'新峰值 MB':>11}  结果"
+    )
+    for count in args.nodes:
+        for name, build in FORMATS.items():
+            text = build(count)
+            old_ms, old_peak, old = measure(lambda t: legacy_parse(plugin, t), text, args.iterations)
+            new_ms, new_peak, new = measure(plugin.parse_node_info, text, args.iterations)
+            if name.startswith('clash'):
+                full_ms, full_peak, _ = measure(plugin.load_clash_proxies, text, args.iterations)
+                full = f"{full_ms:>10.1f}", f"{full_peak:>12.1f}"
+            else:
+                full = f"{'-':>10}", f"{'-':>12}"
+            same = new and old['node_count'] == new['node_count'] and old['type_count'] == new['type_count']
+            print(
+                f"{name:<12}{count:>8}{len(text) / (1024 * 1024):>9.1f}{old_ms:>10.1f}{full[0]}{new_ms:>10.1f}"
+                f"{old_ms / new_ms:>7.1f}x{old_peak:>11.1f}{full[1]}{new_peak:>11.1f}  {'一致' if same else '不一致'}"
+            )
+    print("注：结果一致指节点数与类型统计相同；峰值为 tracemalloc 统计的 Python 分配，不含订阅原文本身")
+
+
+def run_regions(plugin, args):
+    wrong = [(name, expected, plugin.classify_region(name))
+             for name, expected in REGION_CORPUS if plugin.classify_region(name) != expected]
+    legacy_wrong = sum(legacy_classify(name) != expected for name, expected in REGION_CORPUS)
+    # 旧实现归类正确、新实现却丢失地区的节点名
+    lost = [name for name, expected in REGION_CORPUS
+            if expected and legacy_classify(name) == expected and plugin.classify_region(name) != expected]
+    print(
+        f"语料 {len(REGION_CORPUS)} 条：旧实现错误 {legacy_wrong} 条，新实现错误 {len(wrong)} 条，"
+        f"旧实现正确而新实现丢失地区 {len(lost)} 条"
+    )
+    for name, expected, got in wrong:
+        print(f"  {name!r}: 期望 {expected}，得到 {got}")
+    for name in lost:
+        print(f"  {name!r}: 旧实现 {legacy_classify(name)}，新实现未归类")
+    names = node_names(args.names, seed=1)
+    for label, classify in (('旧实现', legacy_classify), ('编译正则', plugin.classify_region)):
+        start = perf_counter()
+        for name in names:
+            classify(name)
+        elapsed = perf_counter() - start
+        print(f"{label:<8}{len(names) / elapsed:>14,.0f} 个/秒")
+    if wrong or lost:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command")
+    parse = commands.add_parser("parse", help="订阅解析耗时与内存")
+    parse.add_argument("--nodes", default="10000,50000", help="节点数，逗号分隔")
+    parse.add_argument("--iterations", type=int, default=3)
+    regions = commands.add_parser("regions", help="地区分类语料检查与吞吐量")
+    regions.add_argument("--names", type=int, default=200000, help="吞吐量测试的节点名数量")
+    argv = sys.argv[1:]
+    if not set(argv) & {"parse", "regions"}:
+        # 未指定子命令时默认运行 parse
+        argv.insert(0, "parse")
+    args = parser.parse_args(argv)
+
+    plugin = load_plugin()
+    if args.command == "regions":
+        run_regions(plugin, args)
+    else:
+        args.nodes = [int(count) for count in args.nodes.split(",")]
+        run_parse(plugin, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,115 @@
 import re
 import time
-import requests
+import httpx
 import yaml
 import base64
-from typing import Dict, Optional, Tuple, List
-from urllib.parse import unquote
-from bs4 import BeautifulSoup
-from pagermaid.enums import Message
+import codecs
+import json
+import html
+import random
+from asyncio import (Semaphore, wait_for, gather, get_running_loop, ensure_future, shield,
+                     TimeoutError as AsyncTimeoutError)
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, Optional, Tuple, List
+from hashlib import sha256
+from urllib.parse import parse_qs, unquote, urljoin, urlsplit, urlunsplit
+from pagermaid.enums import Client, Message
 from pagermaid.listener import listener
 from pagermaid.utils import alias_command
-from pagermaid.dependence import client as http_client
+from pagermaid.utils.bot_utils import log
+from pagermaid.dependence import client as http_client, sqlite
+from pagermaid.services import bot, scheduler
 
 UNITS = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 NODE_PATTERNS = [
     'vmess://', 'trojan://', 'ss://', 'ssr://',
     'vless://', 'hy2://', 'hysteria://', 'hy://'
 ]
+# (地区, ISO 代码, 关键词)；英文关键词按整词匹配，国旗 emoji 由 ISO 代码自动识别
 REGION_RULES = [
-    ('香港', ['香港', 'hong kong', 'hongkong', 'hk', '🇭🇰']),
-    ('台湾', ['台湾', 'taiwan', 'tw', '🇹🇼']),
-    ('日本', ['日本', 'japan', 'jp', '🇯🇵']),
-    ('新加坡', ['新加坡', 'singapore', 'sg', '🇸🇬']),
-    ('美国', ['美国', 'united states', 'us', 'usa', '🇺🇸']),
-    ('韩国', ['韩国', 'korea', 'kr', '🇰🇷']),
-    ('德国', ['德国', 'germany', 'de', '🇩🇪']),
-    ('英国', ['英国', 'united kingdom', 'uk', '🇬🇧'])
+    ('香港', 'HK', ['香港', 'hong kong', 'hongkong', 'hk', 'hkt']),
+    ('台湾', 'TW', ['台湾', '臺灣', 'taiwan', 'tw']),
+    ('日本', 'JP', ['日本', '东京', '大阪', 'japan', 'tokyo', 'osaka', 'jp']),
+    ('新加坡', 'SG', ['新加坡', '狮城', 'singapore', 'sg']),
+    ('美国', 'US', ['美国', '洛杉矶', '硅谷', 'united states', 'america', 'usa', 'us']),
+    ('韩国', 'KR', ['韩国', '韓國', '首尔', 'korea', 'seoul', 'kr']),
+    ('德国', 'DE', ['德国', '法兰克福', 'germany', 'frankfurt', 'de']),
+    ('英国', 'GB', ['英国', '伦敦', 'united kingdom', 'london', 'uk']),
+    ('澳门', 'MO', ['澳门', 'macau', 'macao', 'mo']),
+    ('俄罗斯', 'RU', ['俄罗斯', 'russia', 'ru']),
+    ('加拿大', 'CA', ['加拿大', 'canada', 'ca']),
+    ('法国', 'FR', ['法国', 'france', 'paris', 'fr']),
+    ('荷兰', 'NL', ['荷兰', 'netherlands', 'amsterdam', 'nl']),
+    ('澳大利亚', 'AU', ['澳大利亚', '澳洲', 'australia', 'sydney', 'au']),
+    ('印度', 'IN', ['印度', 'india', 'mumbai']),
+    ('土耳其', 'TR', ['土耳其', 'turkey', 'türkiye', 'tr']),
+    ('阿根廷', 'AR', ['阿根廷', 'argentina']),
+    ('巴西', 'BR', ['巴西', 'brazil', 'br']),
+    ('马来西亚', 'MY', ['马来西亚', 'malaysia']),
+    ('泰国', 'TH', ['泰国', 'thailand', 'th']),
+    ('越南', 'VN', ['越南', 'vietnam', 'vn']),
+    ('菲律宾', 'PH', ['菲律宾', 'philippines', 'ph']),
+    ('印度尼西亚', 'ID', ['印度尼西亚', '印尼', 'indonesia']),
 ]
+# 自定义地区规则，JSON：{"地区": ["关键词", ...]}，优先于内置规则
+REGION_RULES_KEY = 'cha.regionRules'
+# 同时检测的链接数、单个链接的总时限（秒），可通过 sqlite 调整
+CONCURRENCY_KEY = 'cha.concurrency'
+URL_TIMEOUT_KEY = 'cha.urlTimeout'
+DEFAULT_CONCURRENCY = 5
+DEFAULT_URL_TIMEOUT = 30
+# 连接与读取分别计时，面板响应慢时不会拖住其他请求
+SUB_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+PANEL_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+MAX_REDIRECTS = 5
+# 检测结果缓存：流量信息几分钟内有效，机场名几天内有效；缓存条目存放在 sqlite 中
+CACHE_PREFIX = 'cha.cache.'
+CACHE_INDEX_KEY = 'cha.cacheIndex'
+CACHE_MAX_ENTRIES = 200
+TRAFFIC_TTL = 5 * 60
+NAME_TTL = 3 * 24 * 3600
+# 机场名按面板域名缓存在内存中；拦截、失败等结果只缓存 NAME_NEGATIVE_TTL
+NAME_NEGATIVE_TTL = 3600
+NEGATIVE_NAMES = {'未知', '该域名仅限国内IP访问', '该域名非机场面板域名', '该域名开启了5s盾'}
+TITLE_READ_BYTES = 8 * 1024
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.I | re.S)
+airport_names: Dict[str, Tuple[float, str]] = {}
+airport_name_tasks: Dict[str, object] = {}
+URL_PATTERN = re.compile(r"https?://[-A-Za-z0-9+&@#/%?=~_|!:,.;]+[-A-Za-z0-9+&@#/%=~_|]")
+# 批量审计：保存的链接列表、单次最多检测的链接数、附件大小上限；报告超过消息长度时以文件发送
+AUDIT_LIST_KEY = 'cha.auditList'
+AUDIT_MAX_URLS = 500
+AUDIT_FILE_LIMIT = 1024 * 1024
+AUDIT_EXPIRING_TOP = 10
+MESSAGE_LIMIT = 4096
+# 定时监控：每 MONITOR_TICK 秒检查一次到期的订阅，每个订阅的检测间隔加入随机抖动，
+# 同一域名两次请求至少间隔 HOST_MIN_INTERVAL；只请求响应头，不下载订阅内容
+MONITOR_KEY = 'cha.monitor'
+SERIES_PREFIX = 'cha.series.'
+SERIES_MAX_POINTS = 500
+MONITOR_TICK = 60
+MONITOR_BATCH = 10
+MONITOR_CONCURRENCY = 4
+MONITOR_JITTER = 0.2
+DEFAULT_MONITOR_HOURS = 6
+MIN_MONITOR_HOURS = 0.5
+HOST_MIN_INTERVAL = 30
+RETRY_INTERVAL = 30 * 60
+DEAD_AFTER_FAILURES = 3
+LOW_TRAFFIC_RATIO = 0.1
+EXPIRE_WARN_SECONDS = 3 * 86400
+host_last_poll: Dict[str, float] = {}
+# 定时检测负责更新的字段，其余字段（间隔、通知的会话等）以用户的最新设置为准
+MONITOR_STATE_FIELDS = ('next_at', 'failures', 'alerts')
+# 检测过程中刷新消息的最小间隔（秒）
+EDIT_INTERVAL = 1.5
+
+
+def get_setting(key: str, default: int) -> int:
+    try:
+        return max(1, int(sqlite.get(key, default)))
+    except (TypeError, ValueError):
+        return default
 
 def format_size(size: int) -> str:
     """将字节大小转换为人类可读的格式"""
@@ -50,19 +134,28 @@ def format_time_remaining(seconds: int) -> str:
     hours = int((seconds % 86400) // 3600)
     return f"{str(days).zfill(2)}天{str(hours).zfill(2)}小时"
 
-def get_filename_from_url(url: str) -> str:
-    """从URL中获取机场名称"""
-    if "sub?target=" in url:
-        pattern = r"url=([^&]*)"
-        match = re.search(pattern, url)
-        if match:
-            return get_filename_from_url(unquote(match.group(1)))
-            
+async def read_title(url: str, headers: Dict) -> Tuple[int, Optional[str]]:
+    """流式读取页面开头，找到 <title> 后立即断开，最多读取 TITLE_READ_BYTES"""
+    async with http_client.stream('GET', url, headers=headers, timeout=PANEL_TIMEOUT,
+                                  follow_redirects=True) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        head = b''
+        async for chunk in response.aiter_bytes():
+            head += chunk
+            if b'</title>' in head.lower() or len(head) >= TITLE_READ_BYTES:
+                break
+    match = TITLE_PATTERN.search(head[:TITLE_READ_BYTES].decode(response.encoding or 'utf-8', 'replace'))
+    return response.status_code, html.unescape(match.group(1)).strip() if match else None
+
+
+async def lookup_airport_name(url: str, base_url: str) -> str:
     if "api/v1/client/subscribe?token" in url:
         url = f"{url}&flag=clash" if "&flag=clash" not in url else url
         try:
-            response = requests.get(url)
-            header = response.headers.get('Content-Disposition')
+            # 只需要响应头中的文件名，不下载订阅内容
+            async with http_client.stream('GET', url, timeout=SUB_TIMEOUT, follow_redirects=True) as response:
+                header = response.headers.get('Content-Disposition')
             if header:
                 pattern = r"filename\*=UTF-8''(.+)"
                 result = re.search(pattern, header)
@@ -71,19 +164,18 @@ def get_filename_from_url(url: str) -> str:
                     return filename.replace("%20", " ").replace("%2B", "+")
         except:
             return '未知'
-            
+
     try:
-        base_url = re.match(r'(https?://[^/]+)', url).group(1)
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
-        response = requests.get(f"{base_url}/auth/login", headers=headers, timeout=10)
-        if response.status_code != 200:
-            response = requests.get(base_url, headers=headers, timeout=1)
-            
-        soup = BeautifulSoup(response.content, 'html.parser')
-        title = str(soup.title.string).replace('登录 — ', '')
-        
+        status, title = await read_title(f"{base_url}/auth/login", headers)
+        if status != 200:
+            status, title = await read_title(base_url, headers)
+        if title is None:
+            return '未知'
+        title = title.replace('登录 — ', '')
+
         if "Attention Required! | Cloudflare" in title:
             return '该域名仅限国内IP访问'
         if "Access denied" in title or "404 Not Found" in title:
@@ -94,144 +186,1084 @@ def get_filename_from_url(url: str) -> str:
     except:
         return '未知'
 
-def get_node_info(url: str, headers: Dict) -> Optional[Dict]:
-    """获取节点信息，包括数量、类型和地区分布"""
+
+async def get_filename_from_url(url: str) -> str:
+    """从URL中获取机场名称，按面板域名缓存，同一域名的并发查询只请求一次"""
+    if "sub?target=" in url:
+        pattern = r"url=([^&]*)"
+        match = re.search(pattern, url)
+        if match:
+            return await get_filename_from_url(unquote(match.group(1)))
+
+    match = re.match(r'(https?://[^/]+)', url)
+    if not match:
+        return '未知'
+    base_url = match.group(1).lower()
+    cached = airport_names.get(base_url)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    task = airport_name_tasks.get(base_url)
+    if task is None:
+        task = ensure_future(lookup_airport_name(url, base_url))
+        airport_name_tasks[base_url] = task
+
+        def done(finished):
+            airport_name_tasks.pop(base_url, None)
+            if not finished.cancelled() and finished.exception() is None:
+                name = finished.result()
+                # 失败、被拦截等结果只短时间缓存，稍后重试
+                ttl = NAME_NEGATIVE_TTL if name in NEGATIVE_NAMES else NAME_TTL
+                airport_names[base_url] = (time.monotonic() + ttl, name)
+
+        task.add_done_callback(done)
+    return await shield(task)
+
+
+class NodeStats:
+    """逐个节点累加数量、类型和地区"""
+
+    def __init__(self, types: Optional[List[str]] = None, keys: Optional[set] = None):
+        self.node_count = 0
+        self.type_count = dict.fromkeys(types or (), 0)
+        self.regions = {}
+        # 传入集合时同时收集节点标识（类型|地址|端口），用于跨订阅去重
+        self.keys = keys
+
+    def add_type(self, proxy_type: str):
+        self.node_count += 1
+        self.type_count[proxy_type] = self.type_count.get(proxy_type, 0) + 1
+
+    def add_key(self, proxy_type: str, server, port):
+        if self.keys is not None and server:
+            self.keys.add(f'{proxy_type}|{str(server).lower()}|{port}')
+
+    def add_region(self, text: str):
+        region = classify_region(text)
+        if region:
+            self.regions[region] = self.regions.get(region, 0) + 1
+
+    def result(self) -> Dict:
+        return {
+            'node_count': self.node_count,
+            'type_count': {k: v for k, v in self.type_count.items() if v > 0},
+            'regions': {k: v for k, v in self.regions.items() if v > 0}
+        }
+
+
+# 粘连的英文单词按大小写切分：JPTokyo -> JP, Tokyo；HKBGP 保持为一个全大写片段
+CAMEL_PART = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+')
+# 全大写片段中短代码后面允许跟的线路/城市标记（HKBGP、SGIPLC、USLA），
+# 其他后缀不认，避免 DEMO、USER、TRIAL 这类普通单词被当成地区
+GLUED_SUFFIXES = {'bgp', 'iplc', 'iepl', 'gia', 'cn', 'cmi', 'ntt', 'hkt', 'hgc', 'la', 'sj', 'ny'}
+
+
+class RegionClassifier:
+    """把所有地区关键词编译成一个正则，每个节点名只扫描一遍，取最先出现的地区
+
+    英文按整词查表（`us` 不会匹配 russia，`hk01` 仍能匹配），查不到时再按大小写切分（`JPTokyo`），
+    全大写片段只在短代码后面是线路标记或完整地名时才拆开（`HKBGP01`、`KRSEOUL`）；中文关键词直接匹配，
+    国旗 emoji 按两个区域指示符换算为 ISO 代码"""
+
+    def __init__(self, rules: List[Tuple[str, Optional[str], List[str]]]):
+        self.keywords: Dict[str, str] = {}
+        self.flags: Dict[str, str] = {}
+        for name, iso, keywords in rules:
+            if iso:
+                self.flags.setdefault(iso.upper(), name)
+            for keyword in keywords:
+                # 靠前的规则优先，自定义规则可以覆盖内置关键词
+                self.keywords.setdefault(keyword.lower(), name)
+        self.codes = {k: v for k, v in self.keywords.items() if k.isascii() and k.isalpha() and len(k) <= 3}
+        phrases = [k for k in self.keywords if k.isascii() and not k.isalpha()]
+        others = [k for k in self.keywords if not k.isascii()]
+        alternatives = []
+        if phrases:
+            phrases.sort(key=len, reverse=True)
+            alternatives.append(f"(?<![a-z])(?:{'|'.join(map(re.escape, phrases))})(?![a-z])")
+        if others:
+            others.sort(key=len, reverse=True)
+            alternatives.append('|'.join(map(re.escape, others)))
+        alternatives.append('[a-z]+')
+        alternatives.append('(?P<flag>[\U0001F1E6-\U0001F1FF]{2})')
+        self.pattern = re.compile('|'.join(alternatives), re.I)
+
+    def _glued(self, token: str) -> Optional[str]:
+        """整词查不到时，找粘连在其他字母上的关键词或短代码"""
+        for part in CAMEL_PART.findall(token):
+            region = self.keywords.get(part.lower())
+            if region:
+                return region
+            if part.isupper() and len(part) > 2:
+                part = part.lower()
+                for size in (3, 2):
+                    code, rest = part[:size], part[size:]
+                    if code in self.codes and (
+                            rest in GLUED_SUFFIXES or (rest in self.keywords and rest not in self.codes)):
+                        return self.codes[code]
+        return None
+
+    def classify(self, text: str) -> Optional[str]:
+        for match in self.pattern.finditer(text):
+            token = match.group()
+            if match.lastgroup == 'flag':
+                region = self.flags.get(''.join(chr(ord(c) - 0x1F1E6 + 65) for c in token))
+            else:
+                region = self.keywords.get(token.lower())
+                if region is None and not token.islower():
+                    region = self._glued(token)
+            if region:
+                return region
+        return None
+
+
+def load_region_rules() -> List[Tuple[str, Optional[str], List[str]]]:
+    """自定义规则在前，内置规则在后；自定义规则中与内置同名的地区沿用其国旗"""
+    try:
+        custom = json.loads(sqlite.get(REGION_RULES_KEY, '{}'))
+    except (TypeError, ValueError):
+        custom = {}
+    isos = {name: iso for name, iso, _ in REGION_RULES}
+    rules = [(name, isos.get(name), list(keywords)) for name, keywords in custom.items()]
+    return rules + REGION_RULES
+
+
+region_classifier = RegionClassifier(load_region_rules())
+
+
+def set_region_rule(name: str, keywords: Optional[List[str]]):
+    """添加或替换（keywords 为空时删除）一条自定义地区规则，并重新编译分类器"""
+    global region_classifier
     try:
-        res = requests.get(url, headers=headers, timeout=5)
-        if res.status_code != 200:
+        custom = json.loads(sqlite.get(REGION_RULES_KEY, '{}'))
+    except (TypeError, ValueError):
+        custom = {}
+    if keywords:
+        custom[name] = keywords
+    else:
+        custom.pop(name, None)
+    sqlite[REGION_RULES_KEY] = json.dumps(custom, ensure_ascii=False)
+    region_classifier = RegionClassifier(load_region_rules())
+    return custom
+
+
+def classify_region(text: str) -> Optional[str]:
+    """返回节点名所属的地区"""
+    return region_classifier.classify(text)
+
+
+PROXIES_KEY = re.compile(r'^proxies:[ \t]*(?:#[^\r\n]*)?\r?$', re.M)
+# 流式映射中的一个键值对，引号字符串与单层嵌套映射/列表整体作为值跳过
+FLOW_PAIR = re.compile(
+    r'[{,]\s*([^\s:,{}]+)\s*:\s*'
+    r'("(?:[^"\\]|\\.)*"|\'(?:[^\']|\'\')*\'|\{[^{}]*\}|\[[^\[\]]*\]|[^,}]*)'
+)
+BLOCK_FIELD = re.compile(r'(name|type|server|port)\s*:(?:\s+(.*?))?\s*$')
+NODE_FIELDS = ('name', 'type', 'server', 'port')
+QUOTED_SCALAR = re.compile(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\']|\'\')*)\'')
+
+
+def _yaml_scalar(value: str) -> Optional[str]:
+    """解析单行标量；锚点、别名、多行等无法逐行确定的写法返回 None"""
+    value = value.strip()
+    if value[:1] in ('"', "'"):
+        match = QUOTED_SCALAR.match(value)
+        if not match or value[match.end():].strip()[:1] not in ('', '#'):
             return None
-            
-        # 尝试解析为YAML格式
+        return match.group(1) if match.group(1) is not None else match.group(2)
+    if value[:1] in ('&', '*', '|', '>', '!'):
+        return None
+    return value.split(' #', 1)[0].rstrip()
+
+
+def scan_clash_proxies(text: str, keys: Optional[set] = None) -> Optional[Dict]:
+    """逐行扫描 Clash 配置的 proxies 段，不构建完整的 YAML 对象树
+
+    支持常见的单行 `- {name: ..., type: ...}` 与多行块格式，
+    遇到无法确定的写法返回 None，由调用方改用完整的 YAML 解析"""
+    match = PROXIES_KEY.search(text)
+    if not match:
+        return None
+    stats = NodeStats(keys=keys)
+    item_indent = field_indent = None
+    current = None
+
+    def finish(item) -> bool:
+        if item is None:
+            return True
+        if not item.get('type'):
+            return False
+        stats.add_type(item['type'].lower())
+        stats.add_key(item['type'].lower(), item.get('server'), item.get('port'))
+        stats.add_region(item.get('name', ''))
+        return True
+
+    def add_field(item, line) -> bool:
+        field = BLOCK_FIELD.match(line)
+        if field and field.group(1) not in item:
+            value = _yaml_scalar(field.group(2) or '')
+            if value is None:
+                return False
+            item[field.group(1)] = value
+        return True
+
+    pos, length = match.end() + 1, len(text)
+    while pos < length:
+        end = text.find('\n', pos)
+        if end == -1:
+            end = length
+        line = text[pos:end].rstrip('\r')
+        pos = end + 1
+        stripped = line.lstrip(' ')
+        if not stripped or stripped[0] == '#':
+            continue
+        indent = len(line) - len(stripped)
+        is_item = stripped[0] == '-' and stripped[1:2] in ('', ' ')
+        if indent == 0 and not is_item:
+            # 下一个顶层键，proxies 段结束
+            break
+        if is_item and (item_indent is None or indent == item_indent):
+            if not finish(current):
+                return None
+            item_indent, current = indent, None
+            body = stripped[1:].lstrip(' ')
+            if body.startswith('{'):
+                body = body.split(' #', 1)[0].rstrip()
+                if not body.endswith('}'):
+                    # 跨行的流式映射
+                    return None
+                item = {}
+                for key, value in FLOW_PAIR.findall(body[:-1]):
+                    if key in NODE_FIELDS and key not in item:
+                        item[key] = _yaml_scalar(value) or ''
+                if not finish(item):
+                    return None
+                continue
+            current = {}
+            if body:
+                field_indent = indent + len(stripped) - len(body)
+                if not add_field(current, body):
+                    return None
+            else:
+                field_indent = None
+        elif current is not None and item_indent is not None and indent > item_indent:
+            if field_indent is None:
+                field_indent = indent
+            # 更深的缩进属于嵌套字段（如 ws-opts），不影响统计
+            if indent == field_indent and not add_field(current, stripped):
+                return None
+        else:
+            return None
+    if not finish(current):
+        return None
+    return stats.result() if stats.node_count else None
+
+
+def parse_clash(text: str, keys: Optional[set] = None) -> Optional[Dict]:
+    """统计 Clash 配置中的节点，优先逐行扫描，无法确定时再完整解析"""
+    result = scan_clash_proxies(text, keys)
+    if result is not None:
+        return result
+    return load_clash_proxies(text, keys)
+
+
+def load_clash_proxies(text: str, keys: Optional[set] = None) -> Optional[Dict]:
+    """完整解析 YAML 后统计节点，有 libyaml 时使用 C 实现的 CSafeLoader"""
+    try:
+        config = yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except yaml.YAMLError:
+        return None
+    if not isinstance(config, dict) or not isinstance(config.get('proxies'), list):
+        return None
+    stats = NodeStats(keys=keys)
+    for proxy in config['proxies']:
+        if not isinstance(proxy, dict):
+            continue
+        stats.add_type(str(proxy.get('type', '')).lower())
+        stats.add_key(str(proxy.get('type', '')).lower(), proxy.get('server'), proxy.get('port'))
+        stats.add_region(str(proxy.get('name', '')))
+    return stats.result()
+
+
+BASE64_CHUNK = 64 * 1024
+URLSAFE_BASE64 = str.maketrans('-_', '+/')
+
+
+def iter_base64_lines(text: str):
+    """分块解码 base64 内容并逐行产出，不生成完整的解码字符串"""
+    if re.search(r'\s', text):
+        text = re.sub(r'\s+', '', text)
+    text = text.translate(URLSAFE_BASE64)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    length = len(text)
+    for start in range(0, length, BASE64_CHUNK):
+        chunk = text[start:start + BASE64_CHUNK]
+        if start + BASE64_CHUNK >= length:
+            # 部分订阅省略了结尾的填充
+            chunk += '=' * (-len(chunk) % 4)
+        lines = (tail + decoder.decode(base64.b64decode(chunk, validate=True))).split('\n')
+        tail = lines.pop()
+        yield from lines
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+URI_TYPES = {'hy2': 'hysteria2', 'hy': 'hysteria'}
+
+
+def _b64decode_text(data: str) -> str:
+    """解码链接中的 base64，兼容 urlsafe 字母表与省略的填充"""
+    data = data.strip().replace('-', '+').replace('_', '/')
+    return base64.b64decode(data + '=' * (-len(data) % 4), validate=True).decode('utf-8')
+
+
+def add_uri_key(stats: NodeStats, line: str, scheme: str):
+    """从节点链接中取出地址与端口
+
+    vmess 链接为 base64 编码的 JSON；旧式 ss 链接整体为 base64（method:password@host:port），
+    ssr 链接为 base64 编码的 host:port:protocol:method:obfs:password/?参数"""
+    body = line[len(scheme) + 3:].split('#', 1)[0]
+    try:
+        if scheme == 'vmess':
+            config = json.loads(_b64decode_text(body))
+            server, port = config.get('add'), config.get('port')
+        elif scheme == 'ssr':
+            server, port = _b64decode_text(body).split('/?', 1)[0].rsplit(':', 5)[:2]
+        elif scheme == 'ss' and '@' not in body:
+            server, _, port = _b64decode_text(body.split('?', 1)[0].rstrip('/')).rpartition('@')[2].rpartition(':')
+            server = server.strip('[]')
+        else:
+            parts = urlsplit(line)
+            server, port = parts.hostname, parts.port
+    except (ValueError, TypeError, AttributeError):
+        server = port = None
+    if server:
+        stats.add_key(URI_TYPES.get(scheme, scheme), server, port)
+    elif stats.keys is not None:
+        stats.keys.add(line.split('#', 1)[0])
+
+
+def uri_node_name(line: str, scheme: Optional[str]) -> str:
+    """取出节点链接中的节点名：#后的名称（URL 解码），vmess 的 ps 或 ssr 的 remarks"""
+    if '#' in line:
+        return unquote(line.rsplit('#', 1)[1])
+    body = line[len(scheme) + 3:] if scheme else ''
+    try:
+        if scheme == 'vmess':
+            return str(json.loads(_b64decode_text(body)).get('ps') or '')
+        if scheme == 'ssr':
+            params = parse_qs(_b64decode_text(body).partition('/?')[2])
+            return _b64decode_text(params['remarks'][0]) if 'remarks' in params else ''
+    except (ValueError, TypeError, AttributeError):
+        pass
+    return ''
+
+
+def parse_base64(text: str, keys: Optional[set] = None) -> Optional[Dict]:
+    """统计 base64 编码的节点链接列表"""
+    stats = NodeStats([pattern.replace('://', '') for pattern in NODE_PATTERNS], keys)
+    try:
+        for line in iter_base64_lines(text.strip()):
+            if not line.strip():
+                continue
+            # 检测节点类型
+            scheme = None
+            for pattern in NODE_PATTERNS:
+                if line.startswith(pattern):
+                    scheme = pattern[:-3]
+                    stats.add_type(scheme)
+                    if keys is not None:
+                        add_uri_key(stats, line, scheme)
+                    break
+            # 只按节点名解析地区，链接中的 base64 内容可能碰巧含有地区代码
+            stats.add_region(uri_node_name(line, scheme))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return stats.result()
+
+
+def parse_node_info(text: str, keys: Optional[set] = None) -> Optional[Dict]:
+    """从订阅内容统计节点数量、类型和地区分布；传入 keys 时同时收集节点标识"""
+    if PROXIES_KEY.search(text):
+        return parse_clash(text, keys)
+    result = parse_base64(text, keys)
+    if result is None and 'proxies' in text:
+        # 例如 JSON 写法的配置，交给完整的 YAML 解析
+        return parse_clash(text, keys)
+    return result
+
+
+async def fetch_subscription(url: str, headers: Dict) -> Tuple[httpx.Response, str]:
+    """请求订阅链接并手动跟随跳转，返回最终响应和最终地址；跳转请求复用连接池中的连接"""
+    res = await http_client.get(url, headers=headers, timeout=SUB_TIMEOUT)
+    for _ in range(MAX_REDIRECTS):
+        if res.status_code not in (301, 302, 303, 307, 308) or 'location' not in res.headers:
+            break
+        await res.aclose()
+        url = urljoin(url, res.headers['location'])
+        res = await http_client.get(url, headers=headers, timeout=SUB_TIMEOUT)
+    return res, url
+
+
+def normalize_url(url: str) -> str:
+    """缓存键使用的规范化地址：协议与域名小写，去掉默认端口和锚点"""
+    parts = urlsplit(url.strip())
+    netloc = parts.netloc.lower()
+    if (parts.scheme.lower(), netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', parts.query, ''))
+
+
+def _cache_key(url: str) -> str:
+    return CACHE_PREFIX + sha256(normalize_url(url).encode()).hexdigest()[:24]
+
+
+def load_cached(url: str) -> Optional[Dict]:
+    try:
+        return json.loads(sqlite.get(_cache_key(url), ''))
+    except (TypeError, ValueError):
+        return None
+
+
+def save_cached(url: str, result: Dict):
+    """写入缓存，超过 CACHE_MAX_ENTRIES 时删除最久未更新的条目"""
+    key = _cache_key(url)
+    sqlite[key] = json.dumps(result, ensure_ascii=False)
+    try:
+        index = [k for k in json.loads(sqlite.get(CACHE_INDEX_KEY, '[]')) if k != key]
+    except (TypeError, ValueError):
+        index = []
+    index.append(key)
+    for stale in index[:-CACHE_MAX_ENTRIES]:
         try:
-            config = yaml.safe_load(res.text)
-            if config and 'proxies' in config:
-                type_count = {}
-                regions = {}
-                
-                for proxy in config['proxies']:
-                    # 统计类型
-                    proxy_type = proxy.get('type', '').lower()
-                    type_count[proxy_type] = type_count.get(proxy_type, 0) + 1
-                    
-                    # 解析地区信息
-                    name = proxy.get('name', '').lower()
-                    for region_name, keywords in REGION_RULES:
-                        if any(keyword in name for keyword in keywords):
-                            regions[region_name] = regions.get(region_name, 0) + 1
-                            break
-                
-                return {
-                    'node_count': len(config['proxies']),
-                    'type_count': {k: v for k, v in type_count.items() if v > 0},
-                    'regions': {k: v for k, v in regions.items() if v > 0}
-                }
-        except yaml.YAMLError:
+            del sqlite[stale]
+        except KeyError:
+            pass
+    sqlite[CACHE_INDEX_KEY] = json.dumps(index[-CACHE_MAX_ENTRIES:])
+
+
+def parse_userinfo(header: str) -> List[int]:
+    return [int(x) for x in re.findall(r'\d+', header)]
+
+
+async def fetch_result(url: str, headers: Dict, force: bool = False,
+                       collect_keys: bool = False) -> Optional[Dict]:
+    """检测单个订阅链接，返回结果字典；链接无法访问时返回 None
+
+    collect_keys 为真时忽略缓存并在 node_keys 中返回节点标识集合（不写入缓存）
+
+    流量信息在 TRAFFIC_TTL 内直接使用缓存；过期后带 ETag/Last-Modified 条件请求，
+    订阅内容未变化（304）且响应中带有流量信息时复用缓存的节点统计，不再下载订阅内容"""
+    now = time.time()
+    force = force or collect_keys
+    cached = None if force else load_cached(url)
+    if cached and now - cached['checked_at'] < TRAFFIC_TTL:
+        return dict(cached, from_cache=True)
+
+    request_headers = dict(headers)
+    if cached and cached.get('etag'):
+        request_headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        request_headers['If-Modified-Since'] = cached['last_modified']
+    res, final_url = await fetch_subscription(url, request_headers)
+    if res.status_code == 304 and (not cached or 'subscription-userinfo' not in res.headers):
+        # 部分面板的 304 响应不带流量信息，只能重新完整请求
+        res, final_url = await fetch_subscription(url, headers)
+    if res.status_code not in (200, 304):
+        return None
+
+    result = {
+        'url': final_url,
+        'checked_at': now,
+        'etag': res.headers.get('etag'),
+        'last_modified': res.headers.get('last-modified'),
+        'info': None,
+        'node_info': None,
+    }
+    node_keys = set() if collect_keys else None
+    if 'subscription-userinfo' in res.headers:
+        result['info'] = parse_userinfo(res.headers['subscription-userinfo'])
+        if res.status_code == 304:
+            result['node_info'] = cached['node_info']
+            result['etag'] = result['etag'] or cached.get('etag')
+            result['last_modified'] = result['last_modified'] or cached.get('last_modified')
+        else:
+            # 节点信息直接从本次响应内容统计，不再重复下载；大订阅的解析放到线程中，不阻塞事件循环
+            result['node_info'] = await get_running_loop().run_in_executor(
+                None, parse_node_info, res.text, node_keys)
+
+    name_ttl = NAME_NEGATIVE_TTL if cached and cached.get('name') in NEGATIVE_NAMES else NAME_TTL
+    if cached and cached.get('name') and now - cached.get('name_at', 0) < name_ttl:
+        result['name'], result['name_at'] = cached['name'], cached['name_at']
+    else:
+        result['name'], result['name_at'] = await get_filename_from_url(final_url), now
+    save_cached(url, result)
+    if node_keys is not None:
+        result['node_keys'] = node_keys
+    return result
+
+
+async def fetch_userinfo_header(url: str, headers: Dict) -> Optional[str]:
+    """只取订阅的流量信息响应头：先用 HEAD，不支持时用只请求 1 字节的 GET，收到响应头后立即断开
+
+    返回 subscription-userinfo 响应头，响应中没有时返回空字符串；链接无法访问时返回 None"""
+    try:
+        res = await http_client.head(url, headers=headers, timeout=SUB_TIMEOUT, follow_redirects=True)
+        if res.status_code == 200 and 'subscription-userinfo' in res.headers:
+            return res.headers['subscription-userinfo']
+    except httpx.HTTPError:
+        pass
+    async with http_client.stream('GET', url, headers=dict(headers, Range='bytes=0-0'), timeout=SUB_TIMEOUT,
+                                  follow_redirects=True) as res:
+        if res.status_code in (200, 206):
+            return res.headers.get('subscription-userinfo', '')
+    return None
+
+
+def cached_name(url: str) -> Optional[str]:
+    """不发请求，只从域名缓存或结果缓存中取机场名"""
+    match = re.match(r'(https?://[^/]+)', url)
+    entry = airport_names.get(match.group(1).lower()) if match else None
+    if entry and entry[0] > time.monotonic() and entry[1] not in NEGATIVE_NAMES:
+        return entry[1]
+    cached = load_cached(url)
+    return cached.get('name') if cached else None
+
+
+async def fetch_quick(url: str, headers: Dict) -> Optional[Dict]:
+    """快速模式：只读取流量信息响应头，不下载订阅内容、不统计节点；链接无法访问时返回 None"""
+    header = await fetch_userinfo_header(url, headers)
+    if header is None:
+        return None
+    return {
+        'url': url,
+        'info': parse_userinfo(header) if header else None,
+        'node_info': None,
+        'name': cached_name(url),
+        'quick': True,
+    }
+
+
+def format_result(result: Dict) -> str:
+    """生成单个链接的输出文本"""
+    url = result['url']
+    info_num = result['info']
+    quick = result.get('quick')
+    name_line = f'\n机场名：`{result["name"]}`' if result['name'] or not quick else ''
+    if info_num is None:
+        return f'订阅链接：`{url}`{name_line}\n无流量信息'
+    time_now = int(time.time())
+    node_info = result['node_info']
+    node_count = node_info['node_count'] if node_info else '未知'
+
+    # 生成输出信息
+    output_lines = [
+        f'订阅链接：`{url}`{name_line}',
+        f'已用上行：`{format_size(info_num[0])}`',
+        f'已用下行：`{format_size(info_num[1])}`',
+        f'剩余：`{format_size(info_num[2] - info_num[1] - info_num[0])}`',
+        f'总共：`{format_size(info_num[2])}`',
+        f'使用比例：`{round((info_num[0] + info_num[1]) / info_num[2] * 100, 2)}%`',
+    ]
+    if not quick:
+        output_lines.append(f'节点数量：`{node_count}`')
+
+    if node_info:
+        if node_info['type_count']:
+            type_str = ', '.join(f'{k}:{v}' for k, v in node_info['type_count'].items())
+            output_lines.append(f'节点类型：`{type_str}`')
+        if node_info['regions']:
+            region_str = ', '.join(f'{k}:{v}' for k, v in node_info['regions'].items())
+            output_lines.append(f'节点地区：`{region_str}`')
+
+    # 添加过期时间信息
+    if len(info_num) >= 4:
+        expire_time = time.strftime("%Y-%m-%d", time.localtime(info_num[3] + 28800))
+        if time_now <= info_num[3]:
+            remaining = format_time_remaining(info_num[3] - time_now)
+            output_lines.append(f'此订阅将于`{expire_time}`过期，剩余`{remaining}`')
+        else:
+            output_lines.append(f'此订阅已于`{expire_time}`过期！')
+    else:
+        output_lines.append('到期时间：`未知`')
+
+    if result.get('from_cache'):
+        minutes = int((time.time() - result['checked_at']) // 60)
+        output_lines.append(f'（{minutes} 分钟前的缓存结果，使用 cha -f 强制刷新）')
+    return '\n'.join(output_lines)
+
+
+async def check_url(url: str, headers: Dict, force: bool = False) -> str:
+    """检测单个订阅链接，返回该链接的输出文本"""
+    result = await fetch_result(url, headers, force)
+    return format_result(result) if result else '无法访问'
+
+
+class ProgressMessage:
+    """按原顺序汇总各链接的结果，检测过程中限频刷新消息"""
+
+    def __init__(self, msg: Message, count: int):
+        self.msg = msg
+        self.results: List[Optional[str]] = [None] * count
+        self.last_edit = 0.0
+        self.last_text = ''
+
+    def progress(self) -> str:
+        return f'进度：{sum(r is not None for r in self.results)}/{len(self.results)}'
+
+    def pages(self) -> List[str]:
+        """按链接拼接结果，超过单条消息长度时分成多段，单个链接的结果不会被拆开"""
+        parts = [r if r is not None else '检测中...' for r in self.results]
+        if None in self.results:
+            parts.append(self.progress())
+        pages, current = [], ''
+        for part in parts:
+            part = part[:MESSAGE_LIMIT]
+            if current and len(current) + 2 + len(part) > MESSAGE_LIMIT:
+                pages.append(current)
+                current = part
+            else:
+                current = f'{current}\n\n{part}' if current else part
+        pages.append(current)
+        return pages
+
+    async def update(self, index: int, result: str):
+        self.results[index] = result
+        if time.monotonic() - self.last_edit >= EDIT_INTERVAL:
+            await self.flush()
+
+    async def edit(self, text: str):
+        if text == self.last_text:
+            return
+        self.last_edit = time.monotonic()
+        await self.msg.edit(text)
+        # 只记录成功发出的内容，刷新失败时最终输出仍会重新编辑
+        self.last_text = text
+
+    async def flush(self):
+        """刷新进度，结果超过一条消息时只显示进度；检测中的刷新失败不影响检测"""
+        pages = self.pages()
+        text = pages[0] if len(pages) == 1 else f'结果较多，检测完成后分条发送\n{self.progress()}'
+        try:
+            await self.edit(text)
+        except Exception:
             pass
-            
-        # 如果不是YAML格式，尝试base64解码
+
+    async def finish(self, client: Client):
+        """输出全部结果，超过单条消息长度时拆成多条发送；发送失败时抛出"""
+        pages = self.pages()
+        await self.edit(pages[0])
+        for page in pages[1:]:
+            await client.send_message(self.msg.chat.id, page)
+
+
+async def run_checks(url_list: List[str], headers: Dict, on_done: Callable[[int, Optional[Dict], Optional[str]], Awaitable],
+                     force: bool = False, collect_keys: bool = False, quick: bool = False):
+    """并发检测所有链接，数量受限，每个链接单独计时；每个链接完成后调用 on_done(序号, 结果, 错误)"""
+    semaphore = Semaphore(get_setting(CONCURRENCY_KEY, DEFAULT_CONCURRENCY))
+    timeout = get_setting(URL_TIMEOUT_KEY, DEFAULT_URL_TIMEOUT)
+
+    async def run(index: int, url: str):
+        result, error = None, None
+        async with semaphore:
+            try:
+                if quick:
+                    result = await wait_for(fetch_quick(url, headers), timeout)
+                else:
+                    result = await wait_for(fetch_result(url, headers, force, collect_keys), timeout)
+                if result is None:
+                    error = '无法访问'
+            except AsyncTimeoutError:
+                error = '检测超时'
+            except Exception:
+                error = '连接错误'
+        await on_done(index, result, error)
+
+    await gather(*(run(i, url) for i, url in enumerate(url_list)))
+
+
+async def check_urls(url_list: List[str], headers: Dict, progress: ProgressMessage, force: bool = False,
+                     quick: bool = False):
+    """检测所有链接，按原顺序输出每个链接的结果"""
+
+    async def on_done(index: int, result: Optional[Dict], error: Optional[str]):
+        if error == '检测超时':
+            text = f'订阅链接：`{url_list[index]}`\n检测超时'
+        elif error:
+            text = error
+        else:
+            try:
+                text = format_result(result)
+            except Exception:
+                text = '连接错误'
+        await progress.update(index, text)
+
+    await run_checks(url_list, headers, on_done, force, quick=quick)
+
+
+def extract_urls(text: str) -> List[str]:
+    """提取文本中的链接，去重并保持顺序"""
+    return list(dict.fromkeys(URL_PATTERN.findall(text or '')))
+
+
+def load_audit_list() -> List[str]:
+    try:
+        return json.loads(sqlite.get(AUDIT_LIST_KEY, '[]'))
+    except (TypeError, ValueError):
+        return []
+
+
+def build_audit_report(url_list: List[str], outcomes: List[Tuple[Optional[Dict], Optional[str]]]) -> str:
+    """汇总批量检测结果：总流量、即将到期、失效链接、地区分布与跨订阅去重后的节点数"""
+    now = int(time.time())
+    used = total = 0
+    expiring, dead, rows = [], [], []
+    regions: Dict[str, int] = {}
+    node_total = 0
+    node_keys = set()
+    for url, (result, error) in zip(url_list, outcomes):
+        if error:
+            dead.append(f'{url}  {error}')
+            continue
+        info, node_info = result['info'], result['node_info']
+        name = result['name']
+        if node_info:
+            node_total += node_info['node_count']
+            for region, count in node_info['regions'].items():
+                regions[region] = regions.get(region, 0) + count
+        node_keys.update(result.get('node_keys', ()))
+        if not info or len(info) < 3:
+            rows.append(f'{name}  无流量信息  {url}')
+            continue
+        sub_used, sub_total = info[0] + info[1], info[2]
+        used += sub_used
+        total += sub_total
+        expire = info[3] if len(info) >= 4 else None
+        if expire:
+            expiring.append((expire, name, url))
+        rows.append(
+            f'{name}  剩余 {format_size(sub_total - sub_used)} / {format_size(sub_total)}  '
+            f'节点 {node_info["node_count"] if node_info else "未知"}  '
+            f'{time.strftime("%Y-%m-%d", time.localtime(expire + 28800)) if expire else "到期未知"}'
+        )
+
+    lines = [
+        f'订阅审计：共 {len(url_list)} 个链接，可用 {len(url_list) - len(dead)} 个，失效 {len(dead)} 个',
+        f'总流量：{format_size(total)}，已用：{format_size(used)}，剩余：{format_size(total - used)}',
+        f'节点总数：{node_total}，跨订阅去重后：{len(node_keys)}（按 类型+地址+端口 识别）',
+    ]
+    if regions:
+        lines.append('地区分布：' + ', '.join(f'{k}:{v}' for k, v in sorted(regions.items(), key=lambda x: -x[1])))
+    if expiring:
+        lines.append('\n即将到期：')
+        for expire, name, url in sorted(expiring)[:AUDIT_EXPIRING_TOP]:
+            if expire < now:
+                lines.append(f'  已过期  {name}  {url}')
+            else:
+                lines.append(f'  {format_time_remaining(expire - now)}  {name}  {url}')
+    if dead:
+        lines.append('\n失效链接：')
+        lines.extend(f'  {line}' for line in dead)
+    lines.append('\n各订阅：')
+    lines.extend(f'  {row}' for row in rows)
+    return '\n'.join(lines)
+
+
+async def audit_command(client: Client, msg: Message, headers: Dict):
+    """cha -a：批量检测附件、消息中或已保存列表里的订阅链接并生成汇总报告"""
+    source = msg.reply_to_message if msg.reply_to_message and msg.reply_to_message.document else msg
+    if source.document:
+        if source.document.file_size and source.document.file_size > AUDIT_FILE_LIMIT:
+            return await msg.edit('附件过大')
+        data = await source.download(in_memory=True)
+        url_list = extract_urls(bytes(data.getbuffer()).decode('utf-8', 'replace'))
+    else:
+        reply = msg.reply_to_message
+        url_list = extract_urls(reply and (reply.caption or reply.text) or ' '.join(msg.parameter[1:]))
+        if not url_list:
+            url_list = load_audit_list()
+    if not url_list:
+        return await msg.edit('未找到订阅链接，可回复链接列表或附件，或使用 cha -l + 链接 保存列表')
+    url_list = url_list[:AUDIT_MAX_URLS]
+
+    outcomes: List[Optional[Tuple[Optional[Dict], Optional[str]]]] = [None] * len(url_list)
+    last_edit = time.monotonic()
+    await msg.edit(f'正在检测 {len(url_list)} 个订阅链接...')
+
+    async def on_done(index: int, result: Optional[Dict], error: Optional[str]):
+        nonlocal last_edit
+        outcomes[index] = (result, error)
+        if time.monotonic() - last_edit >= EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            done = sum(o is not None for o in outcomes)
+            try:
+                await msg.edit(f'正在检测：{done}/{len(url_list)}')
+            except Exception:
+                pass
+
+    await run_checks(url_list, headers, on_done, collect_keys=True)
+    report = build_audit_report(url_list, outcomes)
+    if len(report) <= MESSAGE_LIMIT:
+        return await msg.edit(report)
+    document = BytesIO(report.encode())
+    document.name = f'cha_audit_{time.strftime("%Y%m%d_%H%M")}.txt'
+    await client.send_document(msg.chat.id, document, caption=report.split('\n\n', 1)[0][:1024])
+    await msg.safe_delete()
+
+
+async def audit_list_command(msg: Message):
+    """cha -l：查看保存的链接；cha -l + 链接...：添加；cha -l - 序号或链接...：删除"""
+    urls = load_audit_list()
+    params = msg.parameter[1:]
+    if params and params[0] in ('+', '-'):
+        reply = msg.reply_to_message
+        given = extract_urls(' '.join(params[1:]) + ' ' + (reply and (reply.caption or reply.text) or ''))
+        if params[0] == '+':
+            urls = list(dict.fromkeys(urls + given))
+        else:
+            indexes = {int(p) - 1 for p in params[1:] if p.isdigit()}
+            urls = [u for i, u in enumerate(urls) if i not in indexes and u not in given]
+        sqlite[AUDIT_LIST_KEY] = json.dumps(urls[:AUDIT_MAX_URLS])
+    if not urls:
+        return await msg.edit('订阅列表为空')
+    text = f'已保存 {len(urls)} 个订阅链接，使用 cha -a 批量检测：\n' + '\n'.join(f'{i + 1}. `{u}`' for i, u in enumerate(urls))
+    await msg.edit(text[:MESSAGE_LIMIT])
+
+
+def load_monitors() -> Dict[str, Dict]:
+    try:
+        return json.loads(sqlite.get(MONITOR_KEY, '{}'))
+    except (TypeError, ValueError):
+        return {}
+
+
+def save_monitors(monitors: Dict[str, Dict]):
+    sqlite[MONITOR_KEY] = json.dumps(monitors, ensure_ascii=False)
+
+
+def _series_key(url: str) -> str:
+    return SERIES_PREFIX + sha256(normalize_url(url).encode()).hexdigest()[:24]
+
+
+def load_series(url: str) -> List[List[int]]:
+    """流量时间序列，每个点为 [时间, 已用, 总量, 到期时间]"""
+    try:
+        return json.loads(sqlite.get(_series_key(url), '[]'))
+    except (TypeError, ValueError):
+        return []
+
+
+def append_series(url: str, info: List[int]):
+    series = load_series(url)
+    series.append([int(time.time()), info[0] + info[1], info[2], info[3] if len(info) >= 4 else 0])
+    sqlite[_series_key(url)] = json.dumps(series[-SERIES_MAX_POINTS:])
+
+
+def jittered(seconds: float) -> float:
+    return seconds * random.uniform(1 - MONITOR_JITTER, 1 + MONITOR_JITTER)
+
+
+def monitor_alerts(info: Optional[List[int]], failures: int) -> Dict[str, bool]:
+    """当前是否处于各个告警状态"""
+    now = time.time()
+    alerts = {'dead': failures >= DEAD_AFTER_FAILURES, 'low': False, 'expiring': False, 'expired': False}
+    if info and len(info) >= 3 and info[2] > 0:
+        alerts['low'] = (info[2] - info[0] - info[1]) / info[2] < LOW_TRAFFIC_RATIO
+    if info and len(info) >= 4 and info[3]:
+        alerts['expired'] = info[3] <= now
+        alerts['expiring'] = 0 < info[3] - now <= EXPIRE_WARN_SECONDS
+    return alerts
+
+
+def format_alert(kind: str, url: str, info: Optional[List[int]]) -> str:
+    cached = load_cached(url)
+    title = f'{cached["name"]}（{url}）' if cached and cached.get('name') else url
+    if kind == 'dead':
+        return f'❌ 订阅连续 {DEAD_AFTER_FAILURES} 次检测失败：{title}'
+    if kind == 'expired':
+        return f'⛔️ 订阅已过期：{title}'
+    if kind == 'expiring':
+        return f'⏰ 订阅即将到期：{title}\n剩余 {format_time_remaining(info[3] - int(time.time()))}'
+    remaining = info[2] - info[0] - info[1]
+    return (f'⚠️ 订阅流量不足：{title}\n剩余 {format_size(remaining)} / {format_size(info[2])}'
+            f'（{round(remaining / info[2] * 100, 2)}%）')
+
+
+async def poll_monitor(url: str, monitor: Dict, headers: Dict) -> List[str]:
+    """检测一个监控中的订阅，更新状态并返回新出现的告警"""
+    host_last_poll[urlsplit(url).netloc.lower()] = time.monotonic()
+    try:
+        header = await fetch_userinfo_header(url, headers)
+    except Exception:
+        header = None
+    # 能访问但没有流量信息的订阅不算失败，只是没有数据可供判断
+    info = parse_userinfo(header) if header else None
+    interval = monitor['hours'] * 3600
+    if header is None:
+        monitor['failures'] = monitor.get('failures', 0) + 1
+        monitor['next_at'] = time.time() + jittered(min(interval, RETRY_INTERVAL))
+    else:
+        monitor['failures'] = 0
+        monitor['next_at'] = time.time() + jittered(interval)
+        if info:
+            append_series(url, info)
+    alerts = monitor_alerts(info, monitor['failures'])
+    previous = monitor.get('alerts', {})
+    # 只在进入告警状态时通知一次；检测失败时保留流量相关的告警状态
+    if info is None:
+        alerts.update({k: v for k, v in previous.items() if k != 'dead'})
+    monitor['alerts'] = alerts
+    return [format_alert(kind, url, info) for kind, on in alerts.items() if on and not previous.get(kind)]
+
+
+async def monitor_tick():
+    """定时任务：挑出到期且所在域名未被限流的订阅进行检测，按需发送告警"""
+    monitors = load_monitors()
+    if not monitors:
+        return
+    now = time.time()
+    picked, hosts = [], set()
+    for url, monitor in sorted(monitors.items(), key=lambda item: item[1]['next_at']):
+        if monitor['next_at'] > now or len(picked) >= MONITOR_BATCH:
+            break
+        host = urlsplit(url).netloc.lower()
+        if host in hosts or time.monotonic() - host_last_poll.get(host, -HOST_MIN_INTERVAL) < HOST_MIN_INTERVAL:
+            continue
+        hosts.add(host)
+        picked.append(url)
+    if not picked:
+        return
+    semaphore = Semaphore(MONITOR_CONCURRENCY)
+    headers = {'User-Agent': 'ClashMeta'}
+
+    async def run(url: str):
+        async with semaphore:
+            return url, await poll_monitor(url, monitors[url], headers)
+
+    results = await gather(*map(run, picked))
+    # 检测期间用户可能增删或修改了监控，只把检测负责的字段合并回最新的监控列表
+    latest = load_monitors()
+    pending = []
+    for url, alerts in results:
+        if url not in latest:
+            continue
+        latest[url].update({key: monitors[url][key] for key in MONITOR_STATE_FIELDS})
+        pending.extend((latest[url]['chat_id'], text) for text in alerts)
+    # 先保存状态再发送，进程在两者之间退出时不会重复发出同一条告警
+    save_monitors(latest)
+    for chat_id, text in pending:
         try:
-            decoded_content = base64.b64decode(res.text).decode('utf-8')
-            type_count = {pattern.replace('://', ''): 0 for pattern in NODE_PATTERNS}
-            regions = {}
-            node_count = 0
-            
-            for line in decoded_content.splitlines():
-                if not line.strip():
+            await bot.send_message(chat_id, text)
+        except Exception as e:
+            await log(f"cha 监控告警发送失败: {e}")
+
+
+scheduler.add_job(monitor_tick, 'interval', seconds=MONITOR_TICK, id='cha_monitor', replace_existing=True)
+
+
+def describe_monitor(url: str, monitor: Dict) -> str:
+    series = load_series(url)
+    text = f'`{url}` 每 {monitor["hours"]:g} 小时'
+    if series:
+        ts, used, total, _ = series[-1]
+        text += f'，剩余 {format_size(total - used)} / {format_size(total)}'
+        day_ago = [point for point in series if point[0] <= ts - 86400]
+        if day_ago and day_ago[-1][1] <= used:
+            text += f'，近 24 小时用量 {format_size(used - day_ago[-1][1])}'
+    if monitor.get('failures'):
+        text += f'，连续失败 {monitor["failures"]} 次'
+    return text
+
+
+async def monitor_command(msg: Message):
+    """cha -m：查看监控；cha -m + 链接... [间隔小时]：添加；cha -m - 序号或链接...：删除"""
+    monitors = load_monitors()
+    params = msg.parameter[1:]
+    if params and params[0] in ('+', '-'):
+        reply = msg.reply_to_message
+        given = extract_urls(' '.join(params[1:]) + ' ' + (reply and (reply.caption or reply.text) or ''))
+        if params[0] == '+':
+            hours = DEFAULT_MONITOR_HOURS
+            for param in params[1:]:
+                try:
+                    hours = max(MIN_MONITOR_HOURS, float(param))
+                except ValueError:
                     continue
-                    
-                # 检测节点类型
-                for pattern in NODE_PATTERNS:
-                    if line.startswith(pattern):
-                        type_count[pattern.replace('://', '')] += 1
-                        node_count += 1
-                        break
-                        
-                # 解析地区信息
-                line_lower = line.lower()
-                for region_name, keywords in REGION_RULES:
-                    if any(keyword in line_lower for keyword in keywords):
-                        regions[region_name] = regions.get(region_name, 0) + 1
-                        break
-                        
-            return {
-                'node_count': node_count,
-                'type_count': {k: v for k, v in type_count.items() if v > 0},
-                'regions': {k: v for k, v in regions.items() if v > 0}
-            }
-        except:
-            return None
-    except:
-        return None
+            for url in given:
+                monitors[url] = {
+                    'hours': hours,
+                    'chat_id': msg.chat.id,
+                    # 首次检测随机分散在接下来的 10 分钟内
+                    'next_at': time.time() + random.uniform(0, 600),
+                    'failures': 0,
+                    'alerts': monitors.get(url, {}).get('alerts', {}),
+                }
+        else:
+            indexes = {int(p) - 1 for p in params[1:] if p.isdigit()}
+            for i, url in enumerate(list(monitors)):
+                if i in indexes or url in given:
+                    del monitors[url]
+                    try:
+                        del sqlite[_series_key(url)]
+                    except KeyError:
+                        pass
+        save_monitors(monitors)
+    if not monitors:
+        return await msg.edit('没有监控中的订阅，使用 cha -m + 链接 [间隔小时] 添加')
+    lines = [f'监控中的订阅（剩余不足 {LOW_TRAFFIC_RATIO:.0%} 或 {EXPIRE_WARN_SECONDS // 86400} 天内到期时提醒）：']
+    lines += [f'{i + 1}. {describe_monitor(url, monitor)}' for i, (url, monitor) in enumerate(monitors.items())]
+    await msg.edit('\n'.join(lines)[:MESSAGE_LIMIT])
+
+
+async def region_rules_command(msg: Message):
+    """cha -r：查看自定义地区规则；cha -r 地区 关键词1,关键词2：添加或替换；cha -r 地区：删除"""
+    params = msg.parameter[1:]
+    if not params:
+        try:
+            custom = json.loads(sqlite.get(REGION_RULES_KEY, '{}'))
+        except (TypeError, ValueError):
+            custom = {}
+        if not custom:
+            return await msg.edit('暂无自定义地区规则')
+        return await msg.edit('\n'.join(f'{k}：`{", ".join(v)}`' for k, v in custom.items()))
+    name = params[0]
+    keywords = [k.strip() for k in ' '.join(params[1:]).replace('，', ',').split(',') if k.strip()]
+    set_region_rule(name, keywords)
+    await msg.edit(f'已设置地区规则 {name}：`{", ".join(keywords)}`' if keywords else f'已删除地区规则 {name}')
+
 
 @listener(is_plugin=True, outgoing=True, command=alias_command("cha"),
-          description='识别订阅链接并获取信息\n使用方法：使用该命令发送或回复一段带有一条或多条订阅链接的文本',
-          parameters='<url>')
-async def subinfo(_, msg: Message):
+          description='识别订阅链接并获取信息\n使用方法：使用该命令发送或回复一段带有一条或多条订阅链接的文本\n'
+                      '结果会缓存几分钟，使用 cha -f 忽略缓存重新检测；cha -q 只查询流量（只读取响应头，不下载订阅、不统计节点）\n'
+                      '批量审计：cha -a 检测回复的附件（txt/yaml）、消息中或已保存列表里的全部链接并生成汇总报告\n'
+                      '保存列表：cha -l 查看；cha -l + 链接 添加；cha -l - 序号/链接 删除\n'
+                      '定时监控：cha -m 查看；cha -m + 链接 [间隔小时] 添加；cha -m - 序号/链接 删除，流量不足或即将到期时提醒\n'
+                      '自定义节点地区：cha -r 查看；cha -r 地区 关键词1,关键词2 添加；cha -r 地区 删除',
+          parameters='[-f] [-q] <url> | -a | -l [+/-] | -m [+/-] | -r [地区] [关键词]')
+async def subinfo(client: Client, msg: Message):
     """订阅信息查询主函数"""
     headers = {'User-Agent': 'ClashMeta'}
-    
+    if msg.parameter and msg.parameter[0] == '-r':
+        return await region_rules_command(msg)
+    if msg.parameter and msg.parameter[0] == '-l':
+        return await audit_list_command(msg)
+    if msg.parameter and msg.parameter[0] == '-m':
+        return await monitor_command(msg)
+    if msg.parameter and msg.parameter[0] == '-a':
+        try:
+            return await audit_command(client, msg, headers)
+        except Exception as e:
+            return await msg.edit(f'参数错误: {str(e)}')
+
     try:
         message_raw = msg.reply_to_message and (msg.reply_to_message.caption or msg.reply_to_message.text) or (msg.caption or msg.text)
-        url_list = re.findall(r"https?://[-A-Za-z0-9+&@#/%?=~_|!:,.;]+[-A-Za-z0-9+&@#/%=~_|]", message_raw)
+        url_list = URL_PATTERN.findall(message_raw)
         
-        final_output = []
-        for url in url_list:
-            try:
-                res = await http_client.get(url, headers=headers, timeout=5)
-                while res.status_code in (301, 302):
-                    url = res.headers['location']
-                    res = await http_client.get(url, headers=headers, timeout=5)
-                    
-                if res.status_code != 200:
-                    final_output.append('无法访问')
-                    continue
-                    
-                try:
-                    info = res.headers['subscription-userinfo']
-                    info_num = [int(x) for x in re.findall(r'\d+', info)]
-                    time_now = int(time.time())
-                    
-                    # 获取节点信息
-                    node_info = get_node_info(url, headers)
-                    node_count = node_info['node_count'] if node_info else '未知'
-                    
-                    # 生成输出信息
-                    output_lines = [
-                        f'订阅链接：`{url}`',
-                        f'机场名：`{get_filename_from_url(url)}`',
-                        f'已用上行：`{format_size(info_num[0])}`',
-                        f'已用下行：`{format_size(info_num[1])}`',
-                        f'剩余：`{format_size(info_num[2] - info_num[1] - info_num[0])}`',
-                        f'总共：`{format_size(info_num[2])}`',
-                        f'使用比例：`{round((info_num[0] + info_num[1]) / info_num[2] * 100, 2)}%`',
-                        f'节点数量：`{node_count}`'
-                    ]
-                    
-                    if node_info:
-                        if node_info['type_count']:
-                            type_str = ', '.join(f'{k}:{v}' for k, v in node_info['type_count'].items())
-                            output_lines.append(f'节点类型：`{type_str}`')
-                        if node_info['regions']:
-                            region_str = ', '.join(f'{k}:{v}' for k, v in node_info['regions'].items())
-                            output_lines.append(f'节点地区：`{region_str}`')
-                    
-                    # 添加过期时间信息
-                    if len(info_num) >= 4:
-                        expire_time = time.strftime("%Y-%m-%d", time.localtime(info_num[3] + 28800))
-                        if time_now <= info_num[3]:
-                            remaining = format_time_remaining(info_num[3] - time_now)
-                            output_lines.append(f'此订阅将于`{expire_time}`过期，剩余`{remaining}`')
-                        else:
-                            output_lines.append(f'此订阅已于`{expire_time}`过期！')
-                    else:
-                        output_lines.append('到期时间：`未知`')
-                        
-                    final_output.append('\n'.join(output_lines))
-                except KeyError:
-                    final_output.append(f'订阅链接：`{url}`\n机场名：`{get_filename_from_url(url)}`\n无流量信息')
-            except:
-                final_output.append('连接错误')
-                
-        await msg.edit('\n\n'.join(final_output))
+        if not url_list:
+            return await msg.edit('未找到订阅链接')
+        progress = ProgressMessage(msg, len(url_list))
+        await check_urls(url_list, headers, progress, force='-f' in msg.parameter, quick='-q' in msg.parameter)
+        await progress.finish(client)
     except Exception as e:
         await msg.edit(f'参数错误: {str(e)}')
@@ -0,0 +1,342 @@
+""" eat 插件合成流程的离线基准测试
+
+使用仓库中的 e/*.png 模版与合成的头像运行，不需要登录 Telegram：
+    python e/benchmark.py latency [--sizes 160,320,640,1280] [--iterations 10]
+    python e/benchmark.py concurrency [--concurrency 8] [--renders 200] [--executor thread]
+    python e/benchmark.py compare [--iterations 20] [--avatar 640]
+
+latency      逐个模版测量合成 + WebP 编码耗时（p50/p95）、峰值 RSS 与 Python 内存分配
+concurrency  通过插件的执行器同时提交 N 个渲染任务，测量吞吐量与排队后的延迟
+compare      逐个模版比较旧的合成实现（每次重新计算缩放、分配遮罩画布、整图缩小到 512px）
+             与编译模版后的实现（底图与遮罩透明度预先缩放，一次头像缩放 + 一次带遮罩粘贴）
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import resource
+import sys
+import tracemalloc
+import types
+from contextlib import contextmanager
+from os import chdir, getcwd, makedirs, symlink
+from os.path import abspath, dirname, join
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from PIL import Image
+
+PLUGIN_DIR = dirname(abspath(__file__))
+
+
+def synthetic_avatar(size):
+    """带渐变与噪声的合成头像，编码开销接近真实照片"""
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.effect_noise((size, size), 64)
+    return Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.ROTATE_90)))
+
+
+def synthetic_avatar_file(size):
+    """把合成头像写入当前（临时）工作目录，插件的渲染任务按路径读取头像"""
+    path = abspath(f"avatar{size}.jpg")
+    synthetic_avatar(size).save(path, quality=95)
+    return path
+
+
+def percentiles(samples):
+    """返回 (p50, p95)，单位与输入一致"""
+    if len(samples) < 2:
+        return samples[0], samples[0]
+    cuts = quantiles(samples, n=100)
+    return cuts[49], cuts[94]
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _stub_framework():
+    """基准测试只调用纯图像处理函数，用占位模块替代 pyrogram 与 pagermaid"""
+
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+
+    class Placeholder:
+        def __getattr__(self, name):
+            return name
+
+    class User:
+        pass
+
+    class Chat:
+        pass
+
+    module("pyrogram", Client=object)
+    module("pyrogram.enums", MessageEntityType=Placeholder())
+    module(
+        "pyrogram.errors",
+        UsernameNotOccupied=Exception,
+        UsernameInvalid=Exception,
+        FileReferenceExpired=Exception,
+        FileReferenceInvalid=Exception,
+        FileIdInvalid=Exception,
+    )
+    module("pyrogram.types", User=User, Chat=Chat)
+    module("pagermaid")
+    module("pagermaid.utils", lang=lambda key: key)
+    module("pagermaid.utils._path", safe_remove=lambda path: None)
+    module("pagermaid.dependence", sqlite={})
+    module("pagermaid.listener", listener=lambda **kwargs: (lambda func: func))
+    module("pagermaid.services", client=None)
+    module("pagermaid.enums", Message=object)
+
+
+def _load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def load_plugin():
+    """在临时工作目录中加载插件，使 plugins/eat/ 指向仓库中的模版目录；
+    退出时恢复原工作目录并删除临时目录"""
+    _stub_framework()
+    cwd = getcwd()
+    with TemporaryDirectory(prefix="eat-bench-") as workdir:
+        makedirs(join(workdir, "plugins"))
+        symlink(PLUGIN_DIR, join(workdir, "plugins", "eat"))
+        chdir(workdir)
+        try:
+            # eat 依赖的共用插件按 PagerMaid 的方式以 plugins.<名称> 导入
+            sys.modules["plugins"] = types.ModuleType("plugins")
+            for name in ("peer_resolver", "avatar_cache"):
+                _load_module(f"plugins.{name}", join(dirname(PLUGIN_DIR), name, f"{name}.py"))
+            plugin = _load_module("eat", join(PLUGIN_DIR, "e.py"))
+            if plugin.eatConfig.refresh(force=True) != 0:
+                raise SystemExit("config.json 解析失败")
+            yield plugin
+        finally:
+            chdir(cwd)
+
+
+def legacy_paste(base, mask, photo, spec):
+    """编译模版之前的合成实现，作为对照"""
+    mask_size = mask.size
+    photo_size = photo.size
+    if mask_size[0] < photo_size[0] and mask_size[1] < photo_size[1]:
+        scale = photo_size[1] / mask_size[1]
+        photo = photo.resize(
+            (int(photo_size[0] / scale), int(photo_size[1] / scale)), Image.LANCZOS
+        )
+    photo = photo.crop((0, 0, mask_size[0], mask_size[1]))
+    mask1 = Image.new("RGBA", mask_size)
+    mask1.paste(photo, mask=mask)
+    if spec.is_swap:
+        photoBg = Image.new("RGBA", base.size)
+        photoBg.paste(mask1, (spec.x, spec.y), mask1)
+        photoBg.paste(base, (0, 0), base)
+        base = photoBg
+    else:
+        base.paste(mask1, (spec.x, spec.y), mask1)
+    return base
+
+
+def legacy_render(plugin, base, spec, photo):
+    base = legacy_paste(base, plugin.templateCache.get(spec.mask_path, copy=False), photo, spec)
+    if spec.second is not None:
+        second = plugin.eatConfig.templates[spec.second]
+        mask = plugin.templateCache.get(second.mask_path, copy=False)
+        base = legacy_paste(base, mask, photo, second)
+    temp = base.size[0] if base.size[0] > base.size[1] else base.size[1]
+    if temp != 512:
+        scale = 512 / temp
+        base = base.resize(
+            (int(base.size[0] * scale), int(base.size[1] * scale)), Image.LANCZOS
+        )
+    return base
+
+
+def compiled_render(plugin, base, spec, photo):
+    # 编译结果中已包含缩放后的底图，base 参数仅为与旧实现保持相同签名
+    return plugin.render_eat(*compiled_render_args(plugin, spec, photo))
+
+
+def renderable_templates(plugin):
+    """有底图的模版，第二个头像孔使用的模版只有遮罩，随主模版一起合成"""
+    result = []
+    for key, spec in plugin.eatConfig.templates.items():
+        try:
+            plugin.templateCache.get(spec.base_path, copy=False)
+            plugin.templateCache.get(spec.mask_path, copy=False)
+            if spec.second is not None:
+                plugin.templateCache.get(
+                    plugin.eatConfig.templates[spec.second].mask_path, copy=False
+                )
+        except (OSError, KeyError):
+            continue
+        result.append((key, spec))
+    return result
+
+
+def time_render(render, plugin, spec, photo, iterations):
+    # 预热一次，编译模版属于一次性开销，不计入单次合成耗时
+    render(plugin, plugin.templateCache.get(spec.base_path), spec, photo)
+    elapsed = 0.0
+    for _ in range(iterations):
+        base = plugin.templateCache.get(spec.base_path)
+        start = perf_counter()
+        render(plugin, base, spec, photo)
+        elapsed += perf_counter() - start
+    return elapsed / iterations * 1000
+
+
+def render_job_args(plugin, spec, photo):
+    """与插件 eat_it() 提交给执行器的参数一致，photo 为头像路径"""
+    second = None
+    if spec.second is not None:
+        second = (plugin.eatConfig.templates[spec.second], photo)
+    return spec, photo, second
+
+
+def compiled_render_args(plugin, spec, photo):
+    """render_eat() 的参数：编译后的模版与已解码的头像"""
+    template = plugin.compile_template(spec)
+    second = None
+    if spec.second is not None:
+        second_spec = plugin.eatConfig.templates[spec.second]
+        second = (plugin.compile_template(second_spec, template.scale), photo)
+    return template, photo, second
+
+
+def run_latency(plugin, templates, args):
+    print(f"{'头像':>6}{'p50 ms':>10}{'p95 ms':>10}{'最慢模版':>14}{'分配峰值 KB':>14}{'RSS MB':>10}")
+    for size in args.sizes:
+        photo = synthetic_avatar_file(size)
+        samples = []
+        slowest = (0.0, "")
+        alloc_peak = 0
+        for key, spec in templates:
+            job = render_job_args(plugin, spec, photo)
+            plugin._render_job(*job)
+            for _ in range(args.iterations):
+                start = perf_counter()
+                plugin._render_job(*job)
+                elapsed = (perf_counter() - start) * 1000
+                samples.append(elapsed)
+                slowest = max(slowest, (elapsed, key))
+            # tracemalloc 会拖慢每次分配，内存分配单独测量一次，不计入耗时
+            tracemalloc.start()
+            plugin._render_job(*job)
+            alloc_peak = max(alloc_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        p50, p95 = percentiles(samples)
+        print(
+            f"{size:>6}{p50:>10.2f}{p95:>10.2f}{slowest[1]:>14}"
+            f"{alloc_peak / 1024:>14.1f}{peak_rss_mb():>10.1f}"
+        )
+    second = [key for key, spec in templates if spec.second is not None]
+    print(f"共 {len(templates)} 个模版，其中双头像模版 {len(second)} 个：{', '.join(second)}")
+    print("注：Pillow 像素缓冲区不经过 Python 分配器，分配峰值只统计 Python 对象，像素内存体现在 RSS 中")
+
+
+async def _run_concurrency(plugin, templates, args):
+    loop = asyncio.get_running_loop()
+    executor = plugin.get_render_executor()
+    photo = synthetic_avatar_file(args.avatar)
+    jobs = [render_job_args(plugin, spec, photo) for _, spec in templates]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(index):
+        async with semaphore:
+            start = perf_counter()
+            await loop.run_in_executor(executor, plugin._render_job, *jobs[index % len(jobs)])
+            latencies.append((perf_counter() - start) * 1000)
+
+    # 预热执行器（进程池需要启动子进程）
+    await asyncio.gather(*(one(i) for i in range(min(args.concurrency, len(jobs)))))
+    latencies.clear()
+    start = perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.renders)))
+    elapsed = perf_counter() - start
+    p50, p95 = percentiles(latencies)
+    print(
+        f"执行器 {args.executor}，并发 {args.concurrency}，{args.renders} 次渲染："
+        f"{elapsed:.2f} s，{args.renders / elapsed:.1f} 张/秒，"
+        f"p50 {p50:.2f} ms，p95 {p95:.2f} ms，RSS {peak_rss_mb():.1f} MB"
+    )
+
+
+def run_concurrency(plugin, templates, args):
+    plugin.sqlite[plugin.renderExecutorKey] = args.executor
+    plugin.sqlite[plugin.renderWorkersKey] = args.workers
+    asyncio.run(_run_concurrency(plugin, templates, args))
+    plugin.get_render_executor().shutdown()
+
+
+def run_compare(plugin, templates, args):
+    # 与插件的头像缓存一致，使用 RGB 头像
+    photo = synthetic_avatar(args.avatar)
+    total_old = total_new = 0.0
+    print(f"{'模版':<10}{'旧实现 ms':>12}{'编译后 ms':>12}{'加速':>8}")
+    for key, spec in templates:
+        old = time_render(legacy_render, plugin, spec, photo, args.iterations)
+        new = time_render(compiled_render, plugin, spec, photo, args.iterations)
+        total_old += old
+        total_new += new
+        print(f"{key:<10}{old:>12.2f}{new:>12.2f}{old / new:>7.2f}x")
+    print(
+        f"{len(templates)} 个模版合计：旧实现 {total_old:.1f} ms，"
+        f"编译后 {total_new:.1f} ms，{total_old / total_new:.2f}x"
+    )
+
+
+def main():
+    # 未指定子命令时默认运行 latency，因此 latency 的选项也可以直接写在主命令后
+    latency_options = argparse.ArgumentParser(add_help=False)
+    latency_options.add_argument("--sizes", default="160,320,640,1280", help="头像边长，逗号分隔")
+    latency_options.add_argument("--iterations", type=int, default=10)
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[1], parents=[latency_options]
+    )
+    parser.add_argument("--templates", help="只测试指定模版，逗号分隔，如 jm,tc,zou,ada,ti")
+    commands = parser.add_subparsers(dest="command")
+    parser.set_defaults(command="latency")
+    commands.add_parser("latency", help="单次合成耗时与内存", parents=[latency_options])
+    concurrency = commands.add_parser("concurrency", help="并发渲染吞吐量")
+    concurrency.add_argument("--concurrency", type=int, default=8)
+    concurrency.add_argument("--renders", type=int, default=200)
+    concurrency.add_argument("--executor", choices=("thread", "process"), default="thread")
+    concurrency.add_argument("--workers", type=int, default=4)
+    concurrency.add_argument("--avatar", type=int, default=640)
+    compare = commands.add_parser("compare", help="旧实现与编译模版实现对比")
+    compare.add_argument("--iterations", type=int, default=20)
+    compare.add_argument("--avatar", type=int, default=640, help="合成用头像边长")
+    args = parser.parse_args()
+
+    with load_plugin() as plugin:
+        templates = renderable_templates(plugin)
+        if args.templates:
+            wanted = set(args.templates.split(","))
+            templates = [(key, spec) for key, spec in templates if key in wanted]
+        if not templates:
+            raise SystemExit("没有可合成的模版")
+        if args.command == "latency":
+            args.sizes = [int(size) for size in args.sizes.split(",")]
+            run_latency(plugin, templates, args)
+        elif args.command == "concurrency":
+            run_concurrency(plugin, templates, args)
+        else:
+            run_compare(plugin, templates, args)
+
+
+if __name__ == "__main__":
+    main()
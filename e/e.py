@@ -1,13 +1,20 @@
 """ PagerMaid module to handle sticker collection. """
 
-from PIL import Image
+from PIL import Image, ImageChops
 from os.path import exists
-from os import sep
+from os import sep, stat, replace, cpu_count
+from asyncio import Semaphore, gather, get_running_loop
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from hashlib import sha256
+from io import BytesIO
+from uuid import uuid4
 from random import randint
+from types import MappingProxyType
+from typing import NamedTuple, Optional
 
 from pyrogram import Client
-from pyrogram.enums import MessageEntityType
-from pyrogram.errors import UsernameNotOccupied, UsernameInvalid
+from pyrogram.errors import FileReferenceExpired, FileReferenceInvalid, FileIdInvalid
 from pyrogram.types import User, Chat
 
 from pagermaid.utils import lang
@@ -17,7 +24,19 @@ from pagermaid.listener import listener
 from pagermaid.services import client
 from pagermaid.enums import Message
 
-from collections import defaultdict
+# 目标解析与头像缓存由共用插件提供，未安装时 eat 只提示安装
+missingPlugins = []
+try:
+    from plugins.peer_resolver import TargetError, get_target
+except ImportError:
+    missingPlugins.append("peer_resolver")
+try:
+    from plugins.avatar_cache import download_avatar
+except ImportError:
+    missingPlugins.append("avatar_cache")
+
+from collections import defaultdict, OrderedDict
+from threading import Lock
 import json
 
 git_source = "https://gitlab.com/Xtao-Labs/PagerMaid_Plugins/-/raw/v2/"
@@ -36,191 +55,627 @@ extensionConfig = {}
 max_number = len(positions)
 configFilePath = f"plugins{sep}eat{sep}config.json"
 configFileRemoteUrlKey = "eat.configFileRemoteUrl"
+# 模版图片解码缓存上限（按像素字节计算），可通过 eat.templateCacheBytes 调整
+templateCacheBytesKey = "eat.templateCacheBytes"
+templateCacheDefaultBytes = 256 * 1024 * 1024
+# 批量下载模版时的并发数，可通过 eat.downloadConcurrency 调整
+downloadConcurrencyKey = "eat.downloadConcurrency"
+downloadDefaultConcurrency = 8
+# 记录已下载文件的 ETag/Last-Modified/sha256，用于条件请求
+downloadManifestPath = f"plugins{sep}eat{sep}manifest.json"
+# 已解码头像的内存缓存上限
+avatarImageCacheBytes = 64 * 1024 * 1024
+# 图片合成放到线程池（默认）或进程池执行，避免阻塞事件循环
+renderExecutorKey = "eat.renderExecutor"
+renderWorkersKey = "eat.renderWorkers"
+renderExecutor = None
+# 合成结果缓存上限
+resultCacheCountKey = "eat.resultCacheCount"
+resultCacheDefaultCount = 256
+resultCacheBytesKey = "eat.resultCacheBytes"
+resultCacheDefaultBytes = 32 * 1024 * 1024
+
+
+class ImageCache:
+    """按路径缓存解码后的图片（默认 RGBA），按像素字节总量做 LRU 淘汰"""
+
+    def __init__(self, max_bytes, mode="RGBA"):
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.total_bytes = 0
+        self._images = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _size_of(image):
+        return image.size[0] * image.size[1] * len(image.getbands())
+
+    def get(self, path, copy=True):
+        """读取图片，未命中时从磁盘解码；默认返回副本，缓存中的原图不会被修改"""
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None:
+                self._images.move_to_end(path)
+        if image is None:
+            with Image.open(path) as im:
+                image = im.convert(self.mode)
+            self.put(path, image)
+        return image.copy() if copy else image
+
+    def put(self, path, image):
+        size = self._size_of(image)
+        with self._lock:
+            old = self._images.pop(path, None)
+            if old is not None:
+                self.total_bytes -= self._size_of(old)
+            if size > self.max_bytes:
+                return
+            self._images[path] = image
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.total_bytes -= self._size_of(evicted)
+
+    def invalidate(self, path=None):
+        """文件更新后丢弃对应缓存，path 为空时清空全部"""
+        with self._lock:
+            if path is None:
+                self._images.clear()
+                self.total_bytes = 0
+            elif (old := self._images.pop(path, None)) is not None:
+                self.total_bytes -= self._size_of(old)
+
+
+def _cache_limit(key, default):
+    try:
+        return int(sqlite.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+templateCache = ImageCache(_cache_limit(templateCacheBytesKey, templateCacheDefaultBytes))
+# 头像不透明，按 RGB 缓存，缩放时无需预乘透明度
+avatarImageCache = ImageCache(avatarImageCacheBytes, mode="RGB")
+# (TemplateSpec, scale) -> CompiledTemplate，按条数做 LRU 淘汰
+compiledTemplates = OrderedDict()
+compiledTemplateCount = 64
+compiledTemplatesLock = Lock()
+# 模版或配置每次变化时递增，进程池的子进程据此丢弃自己持有的旧模版缓存
+templateGeneration = 0
+
+
+def clear_compiled_templates():
+    global templateGeneration
+    with compiledTemplatesLock:
+        compiledTemplates.clear()
+        templateGeneration += 1
+
+
+def template_path(kind, number):
+    return f"plugins{sep}eat{sep}{kind}{str(number)}.png"
+
+
+def mergeDict(d1, d2):
+    dd = defaultdict(list)
+
+    for d in (d1, d2):
+        for key, value in d.items():
+            dd[key] = value
+    return dict(dd)
 
 
-async def eat_it(context, target_user, base, mask, photo, number, layer=0):
-    mask_size = mask.size
-    photo_size = photo.size
+class TemplateSpec(NamedTuple):
+    base_path: str
+    mask_path: str
+    x: int
+    y: int
+    second: Optional[str]
+    is_swap: bool
+    notify: str
+
+
+class EatConfig:
+    """config.json 的只读编译结果，仅在文件 mtime/size 变化或强制刷新时重新解析"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self._stamp = None
+        self.fetch_summary = ""
+        self._compile({}, {}, {}, [])
+
+    def _compile(self, positions_, notifies, extension, download_list):
+        # 与预设合并，配置文件中的同名项覆盖预设
+        positions_ = mergeDict(positions, positions_)
+        notifies = mergeDict(notifyStrArr, notifies)
+        extension = mergeDict(extensionConfig, extension)
+        templates = {}
+        for key, value in positions_.items():
+            key = str(key)
+            templates[key] = TemplateSpec(
+                base_path=template_path("eat", key),
+                mask_path=template_path("mask", key),
+                x=value[0],
+                y=value[1],
+                second=str(value[2]) if len(value) > 2 else None,
+                is_swap=bool((extension.get(key) or {}).get("isSwap", False)),
+                notify=notifies.get(key, "吃头像"),
+            )
+        seconds = {spec.second for spec in templates.values() if spec.second}
+        clear_compiled_templates()
+        self.templates = MappingProxyType(templates)
+        # 第二头像孔使用的模版不单独列出
+        self.listing = "，".join(key for key in templates if key not in seconds)
+        self.download_list = tuple(download_list)
+        self.version += 1
+
+    def refresh(self, force=False):
+        """检查配置文件是否变化，必要时重新解析；返回 0 成功，-1 失败（保留旧配置）"""
+        try:
+            st = stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp and not force:
+            return 0
+        if stamp is None:
+            self._compile({}, {}, {}, [])
+            self._stamp = None
+            return 0
+        try:
+            with open(self.path, "r", encoding="utf8") as cf:
+                remoteConfigJson = json.load(cf)
+            self._compile(
+                remoteConfigJson["positions"],
+                remoteConfigJson["notifies"],
+                # 新增扩展配置，为了兼容旧的配置文件，允许缺失
+                remoteConfigJson.get("extensionConfig") or {},
+                remoteConfigJson["needDownloadFileList"],
+            )
+        except Exception:
+            return -1
+        self._stamp = stamp
+        return 0
+
+    def invalidate(self):
+        """配置文件被重新下载后调用，下次 refresh 时必定重新解析"""
+        self._stamp = -1
+
+
+eatConfig = EatConfig(configFilePath)
+
+
+class CompiledTemplate(NamedTuple):
+    """模版的静态几何信息，全部按最终 512px 输出尺寸预先缩放，合成时只需
+    一次头像缩放、一次带遮罩粘贴"""
+    spec: TemplateSpec
+    scale: float
+    # 缩放后的底图，第二个头像孔的模版没有底图
+    base: Optional[Image.Image]
+    # 原始遮罩尺寸，用于按原逻辑计算头像缩放
+    mask_size: tuple
+    # 缩放后的遮罩尺寸、透明度通道与粘贴位置
+    paste_size: tuple
+    alpha: Image.Image
+    offset: tuple
+
+
+def output_size(size):
+    # 贴纸要求最长边为 512
+    temp = size[0] if size[0] > size[1] else size[1]
+    if temp == 512:
+        return size
+    scale = 512 / temp
+    return int(size[0] * scale), int(size[1] * scale)
+
+
+def compile_template(spec, scale=None):
+    """获取模版的编译结果；scale 为空时按底图计算，第二个头像孔沿用主模版的 scale"""
+    key = (spec, scale)
+    with compiledTemplatesLock:
+        compiled = compiledTemplates.get(key)
+        if compiled is not None:
+            compiledTemplates.move_to_end(key)
+            return compiled
+    base = None
+    if scale is None:
+        base = templateCache.get(spec.base_path, copy=False)
+        size = output_size(base.size)
+        scale = size[0] / base.size[0]
+        if size != base.size:
+            base = base.resize(size, Image.LANCZOS)
+    mask = templateCache.get(spec.mask_path, copy=False)
+    paste_size = (round(mask.size[0] * scale), round(mask.size[1] * scale))
+    alpha = mask.getchannel("A")
+    if paste_size != mask.size:
+        alpha = alpha.resize(paste_size, Image.LANCZOS)
+    compiled = CompiledTemplate(
+        spec=spec,
+        scale=scale,
+        base=base,
+        mask_size=mask.size,
+        paste_size=paste_size,
+        alpha=alpha,
+        offset=(round(spec.x * scale), round(spec.y * scale)),
+    )
+    with compiledTemplatesLock:
+        compiledTemplates[key] = compiled
+        while len(compiledTemplates) > compiledTemplateCount:
+            compiledTemplates.popitem(last=False)
+    return compiled
+
+
+def avatar_size(photo_size, mask_size, scale):
+    # 头像比遮罩大时按高度等比缩小到遮罩高度，再整体缩放到输出尺寸
     if mask_size[0] < photo_size[0] and mask_size[1] < photo_size[1]:
-        scale = photo_size[1] / mask_size[1]
-        photo = photo.resize(
-            (int(photo_size[0] / scale), int(photo_size[1] / scale)), Image.LANCZOS
-        )
-    photo = photo.crop((0, 0, mask_size[0], mask_size[1]))
-    mask1 = Image.new("RGBA", mask_size)
-    mask1.paste(photo, mask=mask)
-    numberPosition = positions[str(number)]
-    isSwap = False
+        ratio = photo_size[1] / mask_size[1]
+        photo_size = int(photo_size[0] / ratio), int(photo_size[1] / ratio)
+    return round(photo_size[0] * scale), round(photo_size[1] * scale)
+
+
+def paste_avatar(base, template, photo):
+    """把头像按遮罩贴到模版的指定位置，纯图像处理，可在线程/进程池中执行"""
+    size = avatar_size(photo.size, template.mask_size, template.scale)
+    if size != photo.size:
+        # reducing_gap 先整数倍缩小再 LANCZOS，大倍率缩小时明显更快且画质几乎无差别
+        photo = photo.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    alpha = template.alpha
+    width, height = template.paste_size
+    if size != template.paste_size:
+        photo = photo.crop((0, 0, width, height))
+        if "A" in photo.getbands() and (size[0] < width or size[1] < height):
+            # 带透明度的头像小于遮罩时，超出头像的部分保持透明
+            alpha = ImageChops.multiply(alpha, photo.getchannel("A"))
     # 处理头像，放到和背景同样大小画布的特定位置
-    try:
-        isSwap = extensionConfig[str(number)]["isSwap"]
-    except:
-        pass
-    if isSwap:
+    if template.spec.is_swap:
         photoBg = Image.new("RGBA", base.size)
-        photoBg.paste(mask1, (numberPosition[0], numberPosition[1]), mask1)
+        photoBg.paste(photo, template.offset, alpha)
         photoBg.paste(base, (0, 0), base)
-        base = photoBg
-    else:
-        base.paste(mask1, (numberPosition[0], numberPosition[1]), mask1)
+        return photoBg
+    base.paste(photo, template.offset, alpha)
+    return base
 
-    # 增加判断是否有第二个头像孔
-    isContinue = len(numberPosition) > 2 and layer == 0
-    if isContinue:
-        # 获取发送者头像
-        sender = context.from_user if context.from_user else context.sender_chat
-        if not sender:
-            await context.edit("无法获取发送者信息。")
-            return base
-            
-        # 获取发送者头像
-        sender_photo = None
-        if isinstance(sender, User):
-            sender_photo = sender.photo
-        elif isinstance(sender, Chat):
-            sender_photo = sender.photo
-            
-        if not sender_photo:
-            await context.edit("发送者未设置头像。")
-            return base
-            
-        await context._client.download_media(
-            sender_photo.big_file_id, f"plugins{sep}eat{sep}{str(sender.id)}.jpg"
-        )
 
+def render_eat(template, photo, second=None, rotate=False):
+    """合成贴纸；second 为第二个头像孔的 (编译后的模版, 头像)"""
+    if rotate:
+        photo = photo.rotate(180)  # 对图片进行旋转
+    # 交换图层时底图只作为上层粘贴，不需要复制
+    base = template.base if template.spec.is_swap else template.base.copy()
+    base = paste_avatar(base, template, photo)
+    if second is not None:
+        base = paste_avatar(base, *second)
+    return base
+
+
+class TemplateLoadError(Exception):
+    """主模版图片加载失败"""
+
+
+def _sync_template_caches(generation):
+    # 线程池与事件循环共用同一份缓存，generation 不会超前；
+    # 只有进程池的子进程会落后于父进程，此时清空子进程里的旧模版
+    global templateGeneration
+    if generation > templateGeneration:
+        templateCache.invalidate()
+        with compiledTemplatesLock:
+            compiledTemplates.clear()
+        templateGeneration = generation
+
+
+def _render_job(spec, photo, second=None, rotate=False, generation=0):
+    """在执行器中完成头像解码、模版编译与合成，返回 (WebP 数据, 加载失败的第二层遮罩名)
+
+    photo 为头像路径，second 为第二个头像孔的 (TemplateSpec, 头像路径)；
+    进程池只能调用模块级函数，参数均为可 pickle 的 TemplateSpec 与路径"""
+    _sync_template_caches(generation)
+    try:
+        template = compile_template(spec)
+    except Exception:
+        raise TemplateLoadError(spec.base_path)
+    photo = avatarImageCache.get(photo, copy=False)
+    secondError = None
+    if second is not None:
+        secondSpec, secondPhoto = second
         try:
-            markImg = Image.open(f"plugins{sep}eat{sep}{str(sender.id)}.jpg")
-            maskImg = Image.open(
-                f"plugins{sep}eat{sep}mask{str(numberPosition[2])}.png"
-            ).convert("RGBA")
-        except:
-            await context.edit(f"图片模版加载出错，请检查并更新配置：mask{str(numberPosition[2])}.png")
-            return base
-        base = await eat_it(
-            context, sender, base, maskImg, markImg, numberPosition[2], layer + 1
-        )
+            second = (
+                compile_template(secondSpec, template.scale),
+                avatarImageCache.get(secondPhoto, copy=False),
+            )
+        except Exception:
+            second = None
+            secondError = f"mask{spec.second}.png"
+    output = BytesIO()
+    render_eat(template, photo, second, rotate=rotate).save(output, "WEBP")
+    return output.getvalue(), secondError
+
+
+def get_render_executor():
+    """渲染用的执行器，eat.renderExecutor 为 process 时使用进程池，默认线程池"""
+    global renderExecutor
+    if renderExecutor is None:
+        workers = max(1, _cache_limit(renderWorkersKey, min(4, cpu_count() or 1)))
+        if sqlite.get(renderExecutorKey, "thread") == "process":
+            renderExecutor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            renderExecutor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="eat-render"
+            )
+    return renderExecutor
 
-    temp = base.size[0] if base.size[0] > base.size[1] else base.size[1]
-    if temp != 512:
-        scale = 512 / temp
-        base = base.resize(
-            (int(base.size[0] * scale), int(base.size[1] * scale)), Image.LANCZOS
-        )
 
-    return base
+def get_sender_photo(context):
+    sender = context.from_user if context.from_user else context.sender_chat
+    if isinstance(sender, (User, Chat)):
+        return sender.photo
+    return None
+
+
+async def load_second_layer(context, spec):
+    """准备第二个头像孔的模版与发送者头像路径，失败时提示并返回 None"""
+    # 获取发送者头像
+    sender = context.from_user if context.from_user else context.sender_chat
+    if not sender:
+        await context.edit("无法获取发送者信息。")
+        return None
+
+    sender_photo = get_sender_photo(context)
+    if not sender_photo:
+        await context.edit("发送者未设置头像。")
+        return None
+
+    senderPhotoPath = await download_avatar(context._client, sender_photo)
+    if not senderPhotoPath:
+        await context.edit("发送者头像下载失败。")
+        return None
+
+    secondSpec = eatConfig.templates.get(spec.second)
+    if secondSpec is None:
+        await context.edit(f"图片模版加载出错，请检查并更新配置：mask{spec.second}.png")
+        return None
+    return secondSpec, senderPhotoPath
+
+
+async def eat_it(context, spec, photo, rotate=False):
+    """生成贴纸，返回 (WebP 数据, 是否完整合成了所有头像孔)；主模版加载失败时抛出 TemplateLoadError
+
+    图片解码与模版编译都在执行器中进行，冷启动时也不会阻塞事件循环"""
+    # 增加判断是否有第二个头像孔
+    second = None
+    if spec.second is not None:
+        second = await load_second_layer(context, spec)
+    data, secondError = await get_running_loop().run_in_executor(
+        get_render_executor(),
+        partial(
+            _render_job, spec, photo, second, rotate=rotate, generation=templateGeneration
+        ),
+    )
+    if secondError:
+        await context.edit(f"图片模版加载出错，请检查并更新配置：{secondError}")
+    return data, spec.second is None or (second is not None and not secondError)
+
+
+class CachedSticker:
+    __slots__ = ("data", "file_id")
+
+    def __init__(self, data):
+        self.data = data
+        self.file_id = None
+
+
+class ResultCache:
+    """缓存合成好的贴纸（WebP 数据及首次上传后的 file_id），按条数和字节数做 LRU 淘汰"""
+
+    def __init__(self, max_count, max_bytes):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key, data):
+        item = CachedSticker(data)
+        if (old := self._items.pop(key, None)) is not None:
+            self.total_bytes -= len(old.data)
+        self._items[key] = item
+        self.total_bytes += len(data)
+        while self._items and (
+            len(self._items) > self.max_count or self.total_bytes > self.max_bytes
+        ):
+            _, evicted = self._items.popitem(last=False)
+            self.total_bytes -= len(evicted.data)
+        return item
+
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+
+resultCache = ResultCache(
+    _cache_limit(resultCacheCountKey, resultCacheDefaultCount),
+    _cache_limit(resultCacheBytesKey, resultCacheDefaultBytes),
+)
+
+
+async def send_sticker(client_, chat_id, cached, reply_to):
+    """优先用已上传的 file_id 发送，失效时回退为上传 WebP 数据并记录新的 file_id"""
+    if cached.file_id:
+        try:
+            # WebP 上传后会变成贴纸，file_id 类型不是 DOCUMENT，需用 send_cached_media 发送
+            return await client_.send_cached_media(
+                chat_id, cached.file_id, reply_to_message_id=reply_to
+            )
+        except (FileReferenceExpired, FileReferenceInvalid, FileIdInvalid, ValueError):
+            # 只有 file_id 失效或无法使用时才丢弃，权限不足、限流等错误直接抛给调用方
+            cached.file_id = None
+    sticker = BytesIO(cached.data)
+    sticker.name = "eat.webp"
+    message = await client_.send_document(
+        chat_id, sticker, reply_to_message_id=reply_to
+    )
+    media = getattr(message, "sticker", None) or getattr(message, "document", None)
+    if media:
+        cached.file_id = media.file_id
+    return message
 
 
 async def updateConfig(context):
     if configFileRemoteUrl := sqlite.get(configFileRemoteUrlKey, ""):
-        if downloadFileFromUrl(configFileRemoteUrl, configFilePath) == 0:
+        if (await downloadFileFromUrl(configFileRemoteUrl, configFilePath)) == 0:
             return await loadConfigFile(context, True)
         sqlite[configFileRemoteUrlKey] = configFileRemoteUrl
         return -1
     return 0
 
 
+def _write_atomic(filepath, content):
+    # 先写临时文件再替换，避免并发读取或下载中断时得到半个文件
+    tmpPath = f"{filepath}.{uuid4().hex}.tmp"
+    try:
+        with open(tmpPath, "wb") as f:
+            f.write(content)
+        replace(tmpPath, filepath)
+    except:
+        safe_remove(tmpPath)
+        raise
+
+
+def _file_updated(filepath):
+    if filepath == configFilePath:
+        eatConfig.invalidate()
+    else:
+        templateCache.invalidate(filepath)
+    # 模版或配置变化后旧的编译结果与合成结果全部作废
+    clear_compiled_templates()
+    resultCache.clear()
+
+
 async def downloadFileFromUrl(url, filepath):
     try:
         re = await client.get(url)
-        with open(filepath, "wb") as ms:
-            ms.write(re.content)
+        if re.status_code != 200:
+            return -1
+        _write_atomic(filepath, re.content)
     except:
         return -1
+    _file_updated(filepath)
     return 0
 
 
-async def loadConfigFile(context, forceDownload=False):
-    global positions, notifyStrArr, extensionConfig
+def _load_manifest():
     try:
-        with open(configFilePath, "r", encoding="utf8") as cf:
-            # 读取已下载的配置文件
-            remoteConfigJson = json.load(cf)
-            # positionsStr = json.dumps(positions)
-            # positions = json.loads(positionsStr)
-
-            # 读取配置文件中的positions
-            positionsStr = json.dumps(remoteConfigJson["positions"])
-            data = json.loads(positionsStr)
-            # 与预设positions合并
-            positions = mergeDict(positions, data)
-
-            # 读取配置文件中的notifies
-            data = json.loads(json.dumps(remoteConfigJson["notifies"]))
-            # 与预设positions合并
-            notifyStrArr = mergeDict(notifyStrArr, data)
-
-            # 读取配置文件中的extensionConfig
-            try:
-                data = json.loads(json.dumps(remoteConfigJson["extensionConfig"]))
-                # 与预设extensionConfig合并
-                extensionConfig = mergeDict(extensionConfig, data)
-            except:
-                # 新增扩展配置，为了兼容旧的配置文件更新不出错，无视异常
-                pass
-
-            # 读取配置文件中的needDownloadFileList
-            data = json.loads(json.dumps(remoteConfigJson["needDownloadFileList"]))
-            # 下载列表中的文件
-            for file_url in data:
-                try:
-                    fsplit = file_url.split("/")
-                    filePath = f"plugins{sep}eat{sep}{fsplit[len(fsplit) - 1]}"
-                    if not exists(filePath) or forceDownload:
-                        await downloadFileFromUrl(file_url, filePath)
+        with open(downloadManifestPath, "r", encoding="utf8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+async def _fetch_one(url, filepath, manifest, semaphore):
+    """下载单个文件，返回 updated / unchanged / failed"""
+    entry = manifest.get(url, {})
+    headers = {}
+    if exists(filepath):
+        # 本地文件存在时使用条件请求，未变化的模版不会重复传输
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        async with semaphore:
+            re = await client.get(url, headers=headers)
+        if re.status_code == 304:
+            return "unchanged"
+        if re.status_code != 200:
+            return "failed"
+        digest = sha256(re.content).hexdigest()
+        newEntry = {
+            "etag": re.headers.get("ETag"),
+            "last_modified": re.headers.get("Last-Modified"),
+            "sha256": digest,
+        }
+        if entry.get("sha256") == digest and exists(filepath):
+            manifest[url] = newEntry
+            return "unchanged"
+        _write_atomic(filepath, re.content)
+        manifest[url] = newEntry
+    except Exception:
+        return "failed"
+    _file_updated(filepath)
+    return "updated"
+
+
+async def fetchFiles(items, force=False):
+    """并发下载 [(url, 本地路径)]，并发数由 eat.downloadConcurrency 控制；
+    force 为 False 时只下载本地缺失的文件。返回 {状态: [文件名]}"""
+    manifest = _load_manifest()
+    semaphore = Semaphore(
+        max(1, _cache_limit(downloadConcurrencyKey, downloadDefaultConcurrency))
+    )
+    items = [(url, path) for url, path in items if force or not exists(path)]
+    states = await gather(
+        *(_fetch_one(url, path, manifest, semaphore) for url, path in items)
+    )
+    result = {"updated": [], "unchanged": [], "failed": []}
+    for (url, path), state in zip(items, states):
+        result[state].append(url.split("/")[-1])
+    if items:
+        try:
+            _write_atomic(
+                downloadManifestPath,
+                json.dumps(manifest, ensure_ascii=False).encode("utf8"),
+            )
+        except Exception:
+            pass
+    return result
 
-                except:
-                    await context.edit(f"下载文件异常，url：{file_url}")
-                    return -1
-    except:
-        return -1
-    return 0
 
+def fetchSummary(result):
+    notifyStr = "更新模版完成"
+    if result["updated"]:
+        notifyStr = f'{notifyStr}\n成功模版如下：{"，".join(result["updated"])}'
+    if result["unchanged"]:
+        notifyStr = f'{notifyStr}\n未变化模版：{len(result["unchanged"])} 个'
+    if result["failed"]:
+        notifyStr = f'{notifyStr}\n失败模版如下：{"，".join(result["failed"])}'
+    return notifyStr
 
-def mergeDict(d1, d2):
-    dd = defaultdict(list)
 
-    for d in (d1, d2):
-        for key, value in d.items():
-            dd[key] = value
-    return dict(dd)
+def _download_items(urls):
+    return [(url, f"plugins{sep}eat{sep}{url.split('/')[-1]}") for url in urls]
+
+
+async def loadConfigFile(context, forceDownload=False):
+    version = eatConfig.version
+    eatConfig.fetch_summary = ""
+    # 强制下载时配置文件刚被覆盖，mtime 可能未变化，需要强制重新解析
+    if eatConfig.refresh(force=forceDownload) != 0:
+        return -1
+    if eatConfig.version == version and not forceDownload:
+        # 配置未变化，缺失文件已在上次解析时检查过
+        return 0
+    # 下载列表中的文件
+    result = await fetchFiles(_download_items(eatConfig.download_list), forceDownload)
+    eatConfig.fetch_summary = fetchSummary(result)
+    return 0
 
 
 async def downloadFileByIds(ids, context):
-    idsStr = f',{",".join(ids)},'
-    try:
-        with open(configFilePath, "r", encoding="utf8") as cf:
-            # 读取已下载的配置文件
-            remoteConfigJson = json.load(cf)
-            data = json.loads(json.dumps(remoteConfigJson["needDownloadFileList"]))
-            # 下载列表中的文件
-            sucSet = set()
-            failSet = set()
-            for file_url in data:
-                try:
-                    fsplit = file_url.split("/")
-                    fileFullName = fsplit[len(fsplit) - 1]
-                    fileName = (
-                        fileFullName.split(".")[0]
-                        .replace("eat", "")
-                        .replace("mask", "")
-                    )
-                    if f",{fileName}," in idsStr:
-                        filePath = f"plugins{sep}eat{sep}{fileFullName}"
-                        if (await downloadFileFromUrl(file_url, filePath)) == 0:
-                            sucSet.add(fileName)
-                        else:
-                            failSet.add(fileName)
-                except:
-                    failSet.add(fileName)
-                    await context.edit(f"下载文件异常，url：{file_url}")
-            notifyStr = "更新模版完成"
-            if sucSet:
-                notifyStr = f'{notifyStr}\n成功模版如下：{"，".join(sucSet)}'
-            if failSet:
-                notifyStr = f'{notifyStr}\n失败模版如下：{"，".join(failSet)}'
-            await context.edit(notifyStr)
-    except:
-        await context.edit("更新下载模版图片失败，请确认配置文件是否正确")
+    idSet = set(ids)
+    if eatConfig.refresh() != 0:
+        return await context.edit("更新下载模版图片失败，请确认配置文件是否正确")
+    items = []
+    for url, filePath in _download_items(eatConfig.download_list):
+        fileName = (
+            url.split("/")[-1].split(".")[0].replace("eat", "").replace("mask", "")
+        )
+        if fileName in idSet:
+            items.append((url, filePath))
+    await context.edit(fetchSummary(await fetchFiles(items, True)))
 
 
 @listener(
@@ -232,7 +687,8 @@ async def downloadFileByIds(ids, context):
     "当第二个参数是.开头时，头像旋转180°，并且判断r后面是数字则读取对应的配置生成\n\n"
     "当第二个参数是/开头时，在/后面加url则从url下载配置文件保存到本地，如果就一个/，则直接更新配置文件，删除则是/delete；或者/后面加模版id可以手动更新指定模版配置\n\n"
     "当第二个参数是-开头时，在-后面加上模版id，即可设置默认模版-e直接使用该模版，删除默认模版是-e -\n\n"
-    "当第二个参数是!或者！开头时，列出当前可用模版",
+    "当第二个参数是!或者！开头时，列出当前可用模版\n\n"
+    "需要同时安装 peer_resolver 与 avatar_cache 插件",
     parameters="[username/uid] [随意内容]",
 )
 async def eat(client_: Client, context: Message):
@@ -240,64 +696,15 @@ async def eat(client_: Client, context: Message):
         await context.edit("出错了呜呜呜 ~ 无效的参数。")
         return
     diu_round = False
-    if context.from_user:
-        from_user_id = context.from_user.id
-    else:
-        from_user_id = context.sender_chat.id
-    if context.reply_to_message:
-        if context.reply_to_message.from_user:
-            user = context.reply_to_message.from_user
-        else:
-            user = context.reply_to_message.sender_chat
-        if not user:
-            return await context.edit(f"{lang('error_prefix')}{lang('profile_e_no')}")
-    else:
-        if len(context.parameter) == 1:
-            user = context.parameter[0]
-            if user.isdigit():
-                user = int(user)
-        else:
-            if context.from_user:
-                user = context.from_user
-            else:
-                user = context.sender_chat
-        if context.entities is not None:
-            if context.entities[0].type == MessageEntityType.TEXT_MENTION:
-                user = context.entities[0].user
-            elif context.entities[0].type == MessageEntityType.PHONE_NUMBER:
-                user = int(context.parameter[0])
-            elif context.entities[0].type == MessageEntityType.BOT_COMMAND:
-                if context.from_user:
-                    user = context.from_user
-                else:
-                    user = context.sender_chat
-            else:
-                return await context.edit(f"{lang('error_prefix')}{lang('arg_error')}")
-        if not (isinstance(user, User) or isinstance(user, Chat)):
-            if user[:1] in [".", "/", "-", "!"]:
-                if context.from_user:
-                    user = context.from_user
-                else:
-                    user = context.sender_chat
-            else:
-                try:
-                    try:
-                        user = await client_.get_users(user)
-                    except IndexError:
-                        user = await client_.get_chat(user)  # noqa
-                except (UsernameNotOccupied, UsernameInvalid):
-                    return await context.edit(
-                        f"{lang('error_prefix')}{lang('profile_e_nou')}"
-                    )
-                except OverflowError:
-                    return await context.edit(
-                        f"{lang('error_prefix')}{lang('profile_e_long')}"
-                    )
-                except Exception as exception:
-                    return await context.edit(
-                        f"{lang('error_prefix')}{lang('profile_e_nof')}"
-                    )
-    target_user_id = user.id
+    if missingPlugins:
+        await context.edit(
+            f"出错了呜呜呜 ~ 缺少 {'、'.join(missingPlugins)} 插件，请先安装：apt install {' '.join(missingPlugins)}"
+        )
+        return
+    try:
+        user = await get_target(client_, context, self_prefixes=(".", "/", "-", "!"))
+    except TargetError as e:
+        return await context.edit(f"{lang('error_prefix')}{lang(e.args[0])}")
 
     # 获取头像，区分用户和群组
     user_photo = None
@@ -308,22 +715,17 @@ async def eat(client_: Client, context: Message):
 
     if not user_photo:
         return await context.edit("出错了呜呜呜 ~ 此用户/群组无头像。")
-    photo = await client_.download_media(
-        user_photo.big_file_id,
-        f"plugins{sep}eat{sep}" + str(target_user_id) + ".jpg",
-    )
+    photo = await download_avatar(client_, user_photo)
 
     reply_to = context.reply_to_message.id if context.reply_to_message else None
-    if exists(f"plugins{sep}eat{sep}" + str(target_user_id) + ".jpg"):
+    if photo:
         for num in range(1, max_number + 1):
-            if not exists(f"plugins{sep}eat{sep}eat" + str(num) + ".png"):
-                re = await client.get(f"{git_source}eat/eat" + str(num) + ".png")
-                with open(f"plugins{sep}eat{sep}eat" + str(num) + ".png", "wb") as bg:
-                    bg.write(re.content)
-            if not exists(f"plugins{sep}eat{sep}mask" + str(num) + ".png"):
-                re = await client.get(f"{git_source}eat/mask" + str(num) + ".png")
-                with open(f"plugins{sep}eat{sep}mask" + str(num) + ".png", "wb") as ms:
-                    ms.write(re.content)
+            for kind in ("eat", "mask"):
+                if not exists(template_path(kind, num)):
+                    # 临时文件写入后再替换，并发执行时不会读到半个文件
+                    await downloadFileFromUrl(
+                        f"{git_source}eat/{kind}{num}.png", template_path(kind, num)
+                    )
         number = randint(1, max_number)
         try:
             p1 = 0
@@ -373,7 +775,9 @@ async def eat(client_: Client, context: Message):
                                     await context.edit(f"加载配置文件异常，请确认从远程下载的配置文件格式是否正确")
                                     return
                                 else:
-                                    await context.edit(f"下载并加载配置文件成功")
+                                    await context.edit(
+                                        f"下载并加载配置文件成功\n{eatConfig.fetch_summary}"
+                                    )
                         else:
                             # 根据传入模版id更新模版配置，多个用"，"或者","隔开
                             # 判断redis是否有保存配置url
@@ -414,26 +818,16 @@ async def eat(client_: Client, context: Message):
                             )
                             return
                         else:
-                            await context.edit(f"从远程更新配置文件成功")
+                            await context.edit(
+                                f"从远程更新配置文件成功\n{eatConfig.fetch_summary}"
+                            )
                     return
                 elif p1[0] == "！" or p1[0] == "!":
                     # 加载配置
-                    if exists(configFilePath):
-                        if await loadConfigFile(context) != 0:
-                            await context.edit(f"加载配置文件异常，请确认从远程下载的配置文件格式是否正确")
-                            return
-                    txt = ""
-                    if len(positions) > 0:
-                        noShowList = []
-                        for key in positions:
-                            txt = f"{txt}，{key}"
-                            if len(positions[key]) > 2:
-                                noShowList.append(positions[key][2])
-                        for key in noShowList:
-                            txt = txt.replace(f"，{key}", "")
-                        if txt != "":
-                            txt = txt[1:]
-                    await context.edit(f"目前已有的模版列表如下：\n{txt}")
+                    if await loadConfigFile(context) != 0:
+                        await context.edit(f"加载配置文件异常，请确认从远程下载的配置文件格式是否正确")
+                        return
+                    await context.edit(f"目前已有的模版列表如下：\n{eatConfig.listing}")
                     return
             defaultConfig = sqlite.get("eat.default-config", "")
             if isinstance(p2, str):
@@ -461,49 +855,43 @@ async def eat(client_: Client, context: Message):
         except:
             number = randint(1, max_number)
 
-        # 加载配置
-        if exists(configFilePath):
-            if await loadConfigFile(context) != 0:
-                await context.edit(f"加载配置文件异常，请确认从远程下载的配置文件格式是否正确")
-                return
-
-        try:
-            notifyStr = notifyStrArr[str(number)]
-        except:
-            notifyStr = "吃头像"
-        final_msg = await context.edit(f"正在生成 {notifyStr} 图片中 . . .")
-        markImg = Image.open(f"plugins{sep}eat{sep}" + str(target_user_id) + ".jpg")
-        try:
-            eatImg = Image.open(f"plugins{sep}eat{sep}eat" + str(number) + ".png")
-            maskImg = Image.open(
-                f"plugins{sep}eat{sep}mask" + str(number) + ".png"
-            ).convert("RGBA")
-        except:
-            await context.edit(f"图片模版加载出错，请检查并更新配置：{str(number)}")
+        # 加载配置，文件未变化时直接复用已解析的结果
+        if await loadConfigFile(context) != 0:
+            await context.edit(f"加载配置文件异常，请确认从远程下载的配置文件格式是否正确")
             return
 
-        if diu_round:
-            markImg = markImg.rotate(180)  # 对图片进行旋转
-        try:
-            number = str(number)
-        except:
-            pass
-        result = await eat_it(
-            context, user, eatImg, maskImg, markImg, number
+        spec = eatConfig.templates.get(str(number))
+        notifyStr = spec.notify if spec else "吃头像"
+        final_msg = await context.edit(f"正在生成 {notifyStr} 图片中 . . .")
+        # 结果只取决于头像、模版与旋转参数，命中缓存时无需重新合成和上传
+        senderPhoto = get_sender_photo(context) if spec and spec.second else None
+        cacheKey = (
+            user_photo.big_photo_unique_id,
+            senderPhoto.big_photo_unique_id if senderPhoto else None,
+            str(number),
+            diu_round,
+            eatConfig.version,
         )
-        result.save(f"plugins{sep}eat{sep}eat.webp")
-        safe_remove(f"plugins{sep}eat{sep}" + str(target_user_id) + ".jpg")
-        safe_remove(f"plugins{sep}eat{sep}" + str(target_user_id) + ".png")
-        safe_remove(f"plugins{sep}eat{sep}" + str(from_user_id) + ".jpg")
-        safe_remove(f"plugins{sep}eat{sep}" + str(from_user_id) + ".png")
+        cached = resultCache.get(cacheKey)
+        if cached is None:
+            try:
+                if spec is None:
+                    raise TemplateLoadError(str(number))
+                data, complete = await eat_it(context, spec, photo, rotate=diu_round)
+            except TemplateLoadError:
+                await context.edit(f"图片模版加载出错，请检查并更新配置：{str(number)}")
+                return
+            # 第二个头像孔缺失时只发送不缓存，避免之后一直命中不完整的结果
+            cached = resultCache.put(cacheKey, data) if complete else CachedSticker(data)
     else:
         return await context.edit("此用户未设置头像或头像对您不可见。")
     if reply_to:
         try:
-            await client_.send_document(
+            await send_sticker(
+                client_,
                 context.chat.id,
-                f"plugins{sep}eat{sep}eat.webp",
-                reply_to_message_id=reply_to,
+                cached,
+                reply_to,
             )
             await final_msg.safe_delete()
         except TypeError:
@@ -512,15 +900,14 @@ async def eat(client_: Client, context: Message):
             await final_msg.edit("此群组无法发送贴纸。")
     else:
         try:
-            await client_.send_document(
+            await send_sticker(
+                client_,
                 context.chat.id,
-                f"plugins{sep}eat{sep}eat.webp",
-                reply_to_message_id=context.reply_to_top_message_id,
+                cached,
+                context.reply_to_top_message_id,
             )
             await final_msg.safe_delete()
         except TypeError:
             await final_msg.edit("此用户未设置头像或头像对您不可见。")
         except:
             await final_msg.edit("此群组无法发送贴纸。")
-    safe_remove(f"plugins{sep}eat{sep}eat.webp")
-    safe_remove(photo)
@@ -1,17 +1,341 @@
 """ PagerMaid 模块用于查看用户或群组信息 """
 
 from pyrogram import Client
-from pyrogram.enums import MessageEntityType
+from pyrogram.enums import ChatMembersFilter, ChatMemberStatus, MessageEntityType
 from pyrogram.errors import UsernameNotOccupied, UsernameInvalid
-from pyrogram.types import User, Chat
-from os import remove
+from pyrogram.types import User, Chat, ChatMember
+from asyncio import gather, wait_for, shield, ensure_future, Semaphore
 from datetime import datetime
-from typing import Optional
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 from pagermaid.listener import listener
 from pagermaid.utils import lang
 from pagermaid.enums import Message
 
+# 目标解析与头像缓存由共用插件提供，未安装时 kk 只提示安装
+missing_plugins = []
+try:
+    from plugins.peer_resolver import PeerResolver, TargetError, peer_resolver, get_target
+except ImportError:
+    missing_plugins.append("peer_resolver")
+try:
+    from plugins.avatar_cache import download_avatar
+except ImportError:
+    missing_plugins.append("avatar_cache")
+
+# 单个查询的超时时间（秒），超时的部分信息直接省略
+LOOKUP_TIMEOUT = 5
+AVATAR_TIMEOUT = 15
+# 资料缓存时间（秒），超过 TTL 但未超过 TTL * STALE_FACTOR 的数据先返回，同时后台刷新
+BIO_TTL = 3600
+COMMON_CHATS_TTL = 600
+MEMBER_TTL = 120
+ADMINS_TTL = 300
+PHOTO_TTL = 24 * 3600
+STALE_FACTOR = 6
+PROFILE_CACHE_SIZE = 2048
+LOAD_TIMEOUT = 30
+# 批量查询时同时解析的目标数，以及单条消息的长度上限
+BATCH_CONCURRENCY = 8
+MESSAGE_LIMIT = 4096
+
+STATUS_LABELS = {
+    ChatMemberStatus.OWNER: "👑 群主",
+    ChatMemberStatus.ADMINISTRATOR: "⭐️ 管理员",
+    ChatMemberStatus.MEMBER: "👤 成员",
+    ChatMemberStatus.RESTRICTED: "⚠️ 受限制",
+    ChatMemberStatus.LEFT: "💨 已离开",
+    ChatMemberStatus.BANNED: "❌ 被封禁",
+}
+PRIVILEGE_LABELS = (
+    ("can_change_info", "更改信息"),
+    ("can_delete_messages", "删除消息"),
+    ("can_restrict_members", "封禁用户"),
+    ("can_invite_users", "邀请用户"),
+    ("can_pin_messages", "置顶消息"),
+    ("can_promote_members", "添加管理"),
+    ("can_manage_video_chats", "管理语音"),
+)
+
+
+class ProfileCache:
+    """按键缓存查询结果，每类信息单独设置 TTL，同一键的并发加载只发出一次请求"""
+
+    def __init__(self):
+        self._entries: Dict[tuple, Tuple[float, object]] = {}
+        self._pending: Dict[tuple, Awaitable] = {}
+
+    async def get(self, key: tuple, ttl: float, loader: Callable[[], Awaitable], force: bool = False):
+        entry = self._entries.get(key)
+        if entry and not force:
+            age = monotonic() - entry[0]
+            if age < ttl:
+                return entry[1]
+            if age < ttl * STALE_FACTOR:
+                # 先返回旧数据，后台刷新
+                self._load(key, loader)
+                return entry[1]
+        # shield 保证调用方超时不会取消其他调用方共享的加载
+        return await shield(self._load(key, loader))
+
+    def put(self, key: tuple, value) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (monotonic(), value)
+        if len(self._entries) > PROFILE_CACHE_SIZE:
+            # 字典按写入顺序排列，淘汰最早写入的条目
+            del self._entries[next(iter(self._entries))]
+
+    def _load(self, key: tuple, loader: Callable[[], Awaitable]):
+        task = self._pending.get(key)
+        if task is None:
+            task = ensure_future(self._run(key, loader))
+            # 后台刷新失败时没有调用方读取异常，这里取走避免告警
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._pending[key] = task
+        return task
+
+    async def _run(self, key: tuple, loader: Callable[[], Awaitable]):
+        try:
+            value = await wait_for(loader(), LOAD_TIMEOUT)
+            if value is not None:
+                self.put(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+
+profile_cache = ProfileCache()
+
+
+async def fetch(coro, timeout: float = LOOKUP_TIMEOUT):
+    """执行单个查询，出错或超时返回 None，不影响同时进行的其他查询"""
+    if coro is None:
+        return None
+    try:
+        return await wait_for(coro, timeout)
+    except Exception:
+        return None
+
+
+async def count_common_chats(client: Client, user_id: int) -> int:
+    return len(await client.get_common_chats(user_id))
+
+
+async def chat_admins(client: Client, chat_id: int) -> Dict[int, ChatMember]:
+    """群组管理员快照，按用户 ID 索引"""
+    admins = {}
+    async for member in client.get_chat_members(chat_id, filter=ChatMembersFilter.ADMINISTRATORS):
+        if member.user:
+            admins[member.user.id] = member
+    return admins
+
+
+async def get_member(client: Client, chat_id: int, user_id: int, force: bool = False):
+    """群成员信息：管理员直接取自管理员快照，其他成员才单独查询"""
+    admins = await fetch(profile_cache.get(
+        ("admins", chat_id), ADMINS_TTL, lambda: chat_admins(client, chat_id), force,
+    ))
+    if admins and user_id in admins:
+        return admins[user_id]
+    return await profile_cache.get(
+        ("member", chat_id, user_id), MEMBER_TTL,
+        lambda: client.get_chat_member(chat_id, user_id), force,
+    )
+
+
+def privilege_labels(privileges) -> List[str]:
+    if not privileges:
+        return []
+    return [label for attr, label in PRIVILEGE_LABELS if getattr(privileges, attr, False)]
+
+
+async def first_photo_id(client: Client, chat_id: int) -> Optional[str]:
+    """当前头像对应的 Photo file_id，可以直接按引用发送"""
+    async for photo in client.get_chat_photos(chat_id, limit=1):
+        return photo.file_id
+    return None
+
+
+def avatar_source(client: Client, chat_id: int, chat_photo, small: bool, force: bool):
+    """预览模式下载小图（约 160px），否则只取 file_id，不经过本地文件"""
+    if small:
+        return fetch(download_avatar(client, chat_photo, small=True), AVATAR_TIMEOUT)
+    return fetch(profile_cache.get(
+        ("photo", chat_photo.big_photo_unique_id), PHOTO_TTL,
+        lambda: first_photo_id(client, chat_id), force,
+    ))
+
+
+async def send_avatar(client: Client, context: Message, chat_photo, source: Optional[str],
+                      caption: str) -> bool:
+    """发送头像和资料；按引用发送失败时才下载原图再上传"""
+    if source:
+        try:
+            await client.send_photo(context.chat.id, source, caption=caption)
+            return True
+        except Exception:
+            pass
+    path = await fetch(download_avatar(client, chat_photo), AVATAR_TIMEOUT)
+    if not path:
+        return False
+    try:
+        await client.send_photo(context.chat.id, path, caption=caption)
+        return True
+    except Exception:
+        return False
+
+
+def message_origin(message: Message):
+    """消息的原始作者：转发消息取转发来源，否则取发送者"""
+    return (getattr(message, "forward_from", None)
+            or getattr(message, "forward_from_chat", None)
+            or message.from_user
+            or message.sender_chat)
+
+
+def message_words(context: Message) -> list:
+    """按消息中出现的顺序取出命令后的参数，TEXT_MENTION 实体按 offset/length 从文本中切出并换成对应的用户"""
+    # 实体的 offset/length 以 UTF-16 码元计
+    raw = (context.text or context.caption or "").encode("utf-16-le")
+    mentions = sorted(
+        (entity for entity in context.entities or []
+         if entity.type == MessageEntityType.TEXT_MENTION and entity.user),
+        key=lambda entity: entity.offset,
+    )
+    words, pos = [], 0
+    for entity in mentions:
+        words.extend(raw[pos * 2:entity.offset * 2].decode("utf-16-le", "ignore").split())
+        words.append(entity.user)
+        pos = entity.offset + entity.length
+    words.extend(raw[pos * 2:].decode("utf-16-le", "ignore").split())
+    # 第一个词是命令本身
+    return words[1:]
+
+
+def unique_targets(targets: list) -> list:
+    """按 User/Chat 的 ID 或规范化后的用户名/ID 去重，保持原顺序"""
+    result, seen = [], set()
+    for target in targets:
+        key = target.id if isinstance(target, (User, Chat)) else PeerResolver.normalize(target)
+        if key not in seen:
+            seen.add(key)
+            result.append(target)
+    return result
+
+
+async def batch_targets(client: Client, context: Message) -> list:
+    """批量模式的目标：多个参数，或回复一组媒体时组内每条消息的原始作者"""
+    if len(context.parameter) > 1:
+        targets = []
+        for word in message_words(context):
+            if isinstance(word, str):
+                if word in ("-f", "-s"):
+                    continue
+                if word.lstrip("-").isdigit():
+                    word = int(word)
+            targets.append(word)
+        return unique_targets(targets)
+    reply = context.reply_to_message
+    if reply and reply.media_group_id:
+        try:
+            messages = await client.get_media_group(reply.chat.id, reply.id)
+        except Exception:
+            return []
+        # 同一作者的相册只保留一个目标，回到单个目标的详细信息
+        return unique_targets([peer for peer in map(message_origin, messages) if peer])
+    return []
+
+
+async def resolve_many(client: Client, targets: list, force: bool) -> List[tuple]:
+    """并发解析多个目标并去重，返回 (查询, User/Chat 或 lang 错误键) 列表，保持原顺序"""
+    semaphore = Semaphore(BATCH_CONCURRENCY)
+
+    async def resolve(target):
+        if isinstance(target, (User, Chat)):
+            return target
+        async with semaphore:
+            try:
+                return await wait_for(peer_resolver.resolve(client, target, force), LOOKUP_TIMEOUT)
+            except (UsernameNotOccupied, UsernameInvalid):
+                return "profile_e_nou"
+            except OverflowError:
+                return "profile_e_long"
+            except Exception:
+                return "profile_e_nof"
+
+    unique = unique_targets(targets)
+    results, seen = [], set()
+    for target, peer in zip(unique, await gather(*map(resolve, unique))):
+        if isinstance(peer, str):
+            results.append((target, peer))
+        elif peer.id not in seen:
+            seen.add(peer.id)
+            results.append((target, peer))
+    return results
+
+
+def format_batch_row(target, peer) -> str:
+    if isinstance(peer, str):
+        return f"❌ `{target}` » {lang(peer)}"
+    if isinstance(peer, User):
+        name = " ".join(filter(None, (peer.first_name, peer.last_name))) or "已注销"
+        flags = "".join(flag for flag, on in (
+            ("🤖", peer.is_bot), ("✨", peer.is_verified), ("💎", peer.is_premium),
+            ("⛔️", peer.is_scam), ("🚫", peer.is_fake), ("🗑", peer.is_deleted),
+        ) if on)
+        icon = "👤"
+    else:
+        name = peer.title or ""
+        flags = f"{peer.members_count}人" if peer.members_count else ""
+        icon = "📢" if peer.type.value == "channel" else "👥"
+    row = f"{icon} `{peer.id}` {name}"
+    if peer.username:
+        row += f" @{peer.username}"
+    if flags:
+        row += f" {flags}"
+    return row
+
+
+def split_message(lines: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """按行拼接消息，超过长度上限时分成多条"""
+    chunks, current = [], ""
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def kk_batch(client: Client, context: Message, targets: list, force: bool):
+    results = await resolve_many(client, targets, force)
+    found = sum(not isinstance(peer, str) for _, peer in results)
+    lines = [f"📋 **批量查询** » {found}/{len(results)} 个目标\n"]
+    lines.extend(format_batch_row(target, peer) for target, peer in results)
+    chunks = split_message(lines)
+    await context.edit(chunks[0])
+    for chunk in chunks[1:]:
+        await client.send_message(context.chat.id, chunk)
+
+
+def format_resolver_stats() -> str:
+    stats = peer_resolver.stats()
+    total = stats["hits"] + stats["misses"]
+    rate = f"{stats['hits'] / total * 100:.1f}%" if total else "-"
+    return (
+        "📊 **目标解析缓存**\n\n"
+        f"✅ **命中** » {stats['hits']}\n"
+        f"🔍 **未命中** » {stats['misses']}（其中 {stats['coalesced']} 次与进行中的请求合并）\n"
+        f"📈 **命中率** » {rate}\n"
+        f"🗂 **缓存** » {stats['peers']} 个对象，{stats['usernames']} 个用户名"
+    )
+
+
 def format_date(timestamp) -> str:
     """格式化时间戳为易读格式"""
     if not timestamp:
@@ -25,16 +349,40 @@ def format_date(timestamp) -> str:
     outgoing=True,
     command="kk",
     description="查看用户或群组详细信息\n"
-    "用法：直接使用 kk 查看当前聊天信息，kk 回复某条消息查看用户信息，或者使用 kk [用户名/用户ID/群组ID]",
-    parameters="[username/uid/gid]",
+    "用法：直接使用 kk 查看当前聊天信息，kk 回复某条消息查看用户信息，或者使用 kk [用户名/用户ID/群组ID]\n"
+    "使用 kk -f 忽略缓存，重新获取最新信息；kk -s 只发送小尺寸头像预览；kk -c 查看目标解析缓存的命中统计\n"
+    "批量查询：kk @a @b 12345 ...，或回复一组媒体查询组内每条消息的（转发）来源\n"
+    "需要同时安装 peer_resolver 与 avatar_cache 插件",
+    parameters="[-f] [-s] [username/uid/gid ...] | -c",
 )
 async def kk(client: Client, context: Message):
-    if not context.reply_to_message and not context.parameter:
+    if missing_plugins:
+        return await context.edit(
+            f"{lang('error_prefix')}缺少 {'、'.join(missing_plugins)} 插件，"
+            f"请先安装：apt install {' '.join(missing_plugins)}"
+        )
+    if context.parameter == ["-c"]:
+        return await context.edit(format_resolver_stats())
+    force = "-f" in context.parameter
+    small = "-s" in context.parameter
+    if force or small:
+        context.parameter = [p for p in context.parameter if p not in ("-f", "-s")]
+    targets = await batch_targets(client, context)
+    if len(targets) > 1:
+        return await kk_batch(client, context, targets, force)
+    if targets:
+        # 去重后只剩一个目标时显示详细信息
+        user = targets[0]
+        if not isinstance(user, (User, Chat)):
+            ((_, user),) = await resolve_many(client, targets, force)
+            if isinstance(user, str):
+                return await context.edit(f"{lang('error_prefix')}{lang(user)}")
+    elif not context.reply_to_message and not context.parameter:
         if context.chat.type.value in ["group", "supergroup", "channel"]:
             user = context.chat
         elif context.chat.type.value == "private":
             try:
-                user = await client.get_users(context.chat.id)
+                user = await peer_resolver.resolve(client, context.chat.id, force)
             except Exception:
                 user = context.chat
         else:
@@ -42,48 +390,11 @@ async def kk(client: Client, context: Message):
                 user = context.from_user
             else:
                 user = context.sender_chat
-    elif context.reply_to_message:
-        if context.reply_to_message.from_user:
-            user = context.reply_to_message.from_user
-        else:
-            user = context.reply_to_message.sender_chat
-        if not user:
-            return await context.edit(f"{lang('error_prefix')}{lang('profile_e_no')}")
     else:
-        if len(context.parameter) == 1:
-            user = context.parameter[0]
-            if user.isdigit():
-                user = int(user)
-        else:
-            if context.from_user:
-                user = context.from_user
-            else:
-                user = context.sender_chat
-        if context.entities is not None:
-            if context.entities[0].type == MessageEntityType.TEXT_MENTION:
-                user = context.entities[0].user
-            elif context.entities[0].type == MessageEntityType.PHONE_NUMBER:
-                user = int(context.parameter[0])
-            elif context.entities[0].type == MessageEntityType.BOT_COMMAND:
-                if context.from_user:
-                    user = context.from_user
-                else:
-                    user = context.sender_chat
-            else:
-                return await context.edit(f"{lang('error_prefix')}{lang('arg_error')}")
-
-        if not (isinstance(user, User) or isinstance(user, Chat)):
-            try:
-                try:
-                    user = await client.get_users(user)
-                except IndexError:
-                    user = await client.get_chat(user)
-            except (UsernameNotOccupied, UsernameInvalid):
-                return await context.edit(f"{lang('error_prefix')}{lang('profile_e_nou')}")
-            except OverflowError:
-                return await context.edit(f"{lang('error_prefix')}{lang('profile_e_long')}")
-            except Exception as exception:
-                return await context.edit(f"{lang('error_prefix')}{lang('profile_e_nof')}")
+        try:
+            user = await get_target(client, context, force)
+        except TargetError as e:
+            return await context.edit(f"{lang('error_prefix')}{lang(e.args[0])}")
 
     info_text = ""
     link = ""
@@ -98,48 +409,35 @@ async def kk(client: Client, context: Message):
             info_text += f"\n📝 **姓氏** » {user.last_name}"
         if user.username:
             info_text += f"\n🔰 **用户名** » @{user.username}"
-        
-        try:
-            common_chats = await client.get_common_chats(user.id)
-            if common_chats:
-                info_text += f"\n👥 **共同群组** » {len(common_chats)} 个"
-        except Exception:
-            pass
-        
-        if context.chat.type.value in ["group", "supergroup"]:
+
+        # 互不依赖的查询同时发出，总耗时取决于最慢的一个
+        in_group = context.chat.type.value in ["group", "supergroup"]
+        common_chats, chat_member, full_user, photo = await gather(
+            fetch(profile_cache.get(
+                ("common_chats", user.id), COMMON_CHATS_TTL,
+                lambda: count_common_chats(client, user.id), force,
+            )),
+            fetch(get_member(client, context.chat.id, user.id, force) if in_group else None),
+            fetch(profile_cache.get(
+                ("full", user.id), BIO_TTL, lambda: client.get_chat(user.id), force,
+            )),
+            avatar_source(client, user.id, user.photo, small, force)
+            if user.photo and not user.is_bot else fetch(None),
+        )
+
+        if common_chats:
+            info_text += f"\n👥 **共同群组** » {common_chats} 个"
+
+        if in_group:
             try:
-                chat_member = await client.get_chat_member(context.chat.id, user.id)
                 if chat_member:
-                    status_map = {
-                        "ChatMemberStatus.OWNER": "👑 群主",
-                        "ChatMemberStatus.ADMINISTRATOR": "⭐️ 管理员",
-                        "ChatMemberStatus.MEMBER": "👤 成员",
-                        "ChatMemberStatus.RESTRICTED": "⚠️ 受限制",
-                        "ChatMemberStatus.LEFT": "💨 已离开",
-                        "ChatMemberStatus.BANNED": "❌ 被封禁"
-                    }
-                    info_text += f"\n💫 **群内身份** » {status_map.get(str(chat_member.status), str(chat_member.status))}"
-                    
-                    if str(chat_member.status) == "ChatMemberStatus.ADMINISTRATOR":
-                        admin_rights = []
-                        if chat_member.privileges:
-                            if chat_member.privileges.can_change_info:
-                                admin_rights.append("更改信息")
-                            if chat_member.privileges.can_delete_messages:
-                                admin_rights.append("删除消息")
-                            if chat_member.privileges.can_restrict_members:
-                                admin_rights.append("封禁用户")
-                            if chat_member.privileges.can_invite_users:
-                                admin_rights.append("邀请用户")
-                            if chat_member.privileges.can_pin_messages:
-                                admin_rights.append("置顶消息")
-                            if chat_member.privileges.can_promote_members:
-                                admin_rights.append("添加管理")
-                            if chat_member.privileges.can_manage_video_chats:
-                                admin_rights.append("管理语音")
+                    info_text += f"\n💫 **群内身份** » {STATUS_LABELS.get(chat_member.status, str(chat_member.status))}"
+
+                    if chat_member.status == ChatMemberStatus.ADMINISTRATOR:
+                        admin_rights = privilege_labels(chat_member.privileges)
                         if admin_rights:
                             info_text += f"\n🛡 **管理权限** » {' | '.join(admin_rights)}"
-                            
+
                     if hasattr(chat_member, 'joined_date') and chat_member.joined_date:
                         info_text += f"\n📅 **加入时间** » {format_date(chat_member.joined_date)}"
             except Exception as e:
@@ -186,12 +484,8 @@ async def kk(client: Client, context: Message):
         if user.last_online_date:
             other_info.append(f"⏰ **最后在线** » {format_date(user.last_online_date)}")
             
-        try:
-            full_user = await client.get_chat(user.id)
-            if full_user.bio:
-                other_info.append(f"ℹ️ **个性签名** » {full_user.bio}")
-        except Exception:
-            pass
+        if full_user and full_user.bio:
+            other_info.append(f"ℹ️ **个性签名** » {full_user.bio}")
             
         if other_info:
             info_text += "\n\n**其他信息**\n"
@@ -220,14 +514,9 @@ async def kk(client: Client, context: Message):
         })
 
         try:
-            if user.photo and not user.is_bot:
-                photo = await client.download_media(user.photo.big_file_id)
-                await client.send_photo(
-                    context.chat.id,
-                    photo,
-                    caption=info_text
-                )
-                remove(photo)
+            if user.photo and not user.is_bot and await send_avatar(
+                client, context, user.photo, photo, info_text
+            ):
                 await context.delete()
                 return
         except Exception:
@@ -251,13 +540,21 @@ async def kk(client: Client, context: Message):
             info_text += f"\n🔰 **用户名** » @{user.username}"
         if user.members_count:
             info_text += f"\n👥 **成员数** » {user.members_count}"
-            
+
+        chat_member, photo = await gather(
+            # 自己的身份直接查询，不需要拉取整个管理员列表
+            fetch(profile_cache.get(
+                ("member", user.id, "me"), MEMBER_TTL,
+                lambda: client.get_chat_member(user.id, "me"), force,
+            ) if context.from_user else None),
+            avatar_source(client, user.id, user.photo, small, force)
+            if user.photo else fetch(None),
+        )
         try:
-            if context.from_user:
-                chat_member = await client.get_chat_member(user.id, context.from_user.id)
-                if chat_member.status == "creator":
+            if chat_member:
+                if chat_member.status == ChatMemberStatus.OWNER:
                     info_text += f"\n👑 **身份** » 群主"
-                elif chat_member.status == "administrator":
+                elif chat_member.status == ChatMemberStatus.ADMINISTRATOR:
                     info_text += f"\n⭐️ **身份** » 管理员"
         except Exception:
             pass
@@ -331,14 +628,7 @@ async def kk(client: Client, context: Message):
         })
 
         try:
-            if user.photo:
-                photo = await client.download_media(user.photo.big_file_id)
-                await client.send_photo(
-                    context.chat.id,
-                    photo,
-                    caption=info_text
-                )
-                remove(photo)
+            if user.photo and await send_avatar(client, context, user.photo, photo, info_text):
                 await context.delete()
                 return
         except Exception:
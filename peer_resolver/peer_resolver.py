@@ -0,0 +1,175 @@
+""" kk、eat 等插件共用的查询目标解析：用户名/ID 解析为 User 或 Chat，并缓存结果 """
+
+from asyncio import ensure_future, shield
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Dict, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.enums import MessageEntityType
+from pyrogram.errors import UsernameNotOccupied, UsernameInvalid
+from pyrogram.types import User, Chat
+
+from pagermaid.dependence import sqlite
+from pagermaid.enums import Message
+
+# 内存中 ID -> 对象的缓存时间（秒）与条数上限
+PEER_TTL = 600
+PEER_CACHE_SIZE = 2048
+# 用户名 -> ID 映射整体保存在一个 sqlite 键中，超过上限时淘汰最久未更新的用户名
+USERNAMES_KEY = "peer_resolver.usernames"
+USERNAME_LIMIT = 4096
+
+
+class TargetError(Exception):
+    """无法确定查询目标，args[0] 为对应的 lang 文案键"""
+
+
+class PeerResolver:
+    """用户名/ID 解析为 User 或 Chat
+
+    内存中缓存 用户名 -> ID 与 ID -> 对象，用户名映射持久化到 sqlite；
+    同一目标的并发解析只发出一次请求。"""
+
+    def __init__(self, ttl: float = PEER_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._peers: Dict[int, Tuple[float, object]] = OrderedDict()
+        self._usernames: Optional[Dict[str, int]] = None
+        self._pending: Dict[object, Awaitable] = {}
+
+    @staticmethod
+    def normalize(query):
+        if isinstance(query, str):
+            query = query.strip().lstrip("@")
+            if query.lstrip("-").isdigit():
+                return int(query)
+            return query.lower()
+        return query
+
+    @property
+    def usernames(self) -> Dict[str, int]:
+        if self._usernames is None:
+            stored = sqlite.get(USERNAMES_KEY)
+            self._usernames = OrderedDict(stored if isinstance(stored, dict) else {})
+        return self._usernames
+
+    def username_id(self, username: str) -> Optional[int]:
+        return self.usernames.get(username)
+
+    def stats(self) -> Dict[str, int]:
+        """命中、未命中与合并的请求数，以及当前缓存的条目数"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "peers": len(self._peers),
+            "usernames": len(self.usernames),
+        }
+
+    def remember(self, peer) -> None:
+        self._peers.pop(peer.id, None)
+        self._peers[peer.id] = (monotonic(), peer)
+        if len(self._peers) > PEER_CACHE_SIZE:
+            self._peers.popitem(last=False)
+        username = getattr(peer, "username", None)
+        if username:
+            username = username.lower()
+            usernames = self.usernames
+            if usernames.get(username) != peer.id:
+                usernames.pop(username, None)
+                usernames[username] = peer.id
+                while len(usernames) > USERNAME_LIMIT:
+                    usernames.popitem(last=False)
+                sqlite[USERNAMES_KEY] = dict(usernames)
+
+    async def resolve(self, client: Client, query, force: bool = False):
+        key = self.normalize(query)
+        peer_id = key if isinstance(key, int) else self.username_id(key)
+        if not force and peer_id is not None:
+            entry = self._peers.get(peer_id)
+            if entry and monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        task = self._pending.get(key)
+        if task is None:
+            task = ensure_future(self._load(client, key, peer_id))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._pending[key] = task
+        else:
+            self.coalesced += 1
+        # shield 保证调用方超时不会取消其他调用方共享的请求
+        return await shield(task)
+
+    async def _load(self, client: Client, key, peer_id: Optional[int]):
+        try:
+            if peer_id is not None and not isinstance(key, int):
+                # 已知 ID 时按 ID 查询，省去一次用户名解析；会话中没有该 ID 时再按用户名查询
+                try:
+                    peer = await self._get(client, peer_id)
+                    if (getattr(peer, "username", None) or "").lower() == key:
+                        return peer
+                except Exception:
+                    pass
+            return await self._get(client, key)
+        finally:
+            self._pending.pop(key, None)
+
+    async def _get(self, client: Client, query):
+        try:
+            peer = await client.get_users(query)
+        except IndexError:
+            peer = await client.get_chat(query)  # noqa
+        self.remember(peer)
+        return peer
+
+
+peer_resolver = PeerResolver()
+
+
+def target_from_message(context: Message, self_prefixes: Tuple[str, ...] = ()):
+    """从回复、参数或消息实体中取得目标，返回 User/Chat 或待解析的用户名/ID"""
+    self_peer = context.from_user or context.sender_chat
+    if context.reply_to_message:
+        user = context.reply_to_message.from_user or context.reply_to_message.sender_chat
+        if not user:
+            raise TargetError("profile_e_no")
+        return user
+    if len(context.parameter) == 1:
+        user = context.parameter[0]
+        if user.isdigit():
+            user = int(user)
+    else:
+        user = self_peer
+    if context.entities is not None:
+        if context.entities[0].type == MessageEntityType.TEXT_MENTION:
+            user = context.entities[0].user
+        elif context.entities[0].type == MessageEntityType.PHONE_NUMBER:
+            user = int(context.parameter[0])
+        elif context.entities[0].type == MessageEntityType.BOT_COMMAND:
+            user = self_peer
+        else:
+            raise TargetError("arg_error")
+    # 数字 ID 已转为 int，只有字符串参数才判断是否为命令前缀
+    if isinstance(user, str) and user[:1] in self_prefixes:
+        user = self_peer
+    return user
+
+
+async def get_target(client: Client, context: Message, force: bool = False,
+                     self_prefixes: Tuple[str, ...] = ()):
+    """取得并解析查询目标，失败时抛出 TargetError"""
+    user = target_from_message(context, self_prefixes)
+    if isinstance(user, (User, Chat)):
+        return user
+    try:
+        return await peer_resolver.resolve(client, user, force)
+    except (UsernameNotOccupied, UsernameInvalid):
+        raise TargetError("profile_e_nou")
+    except OverflowError:
+        raise TargetError("profile_e_long")
+    except Exception:
+        raise TargetError("profile_e_nof")